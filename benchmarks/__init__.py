@@ -0,0 +1,4 @@
+""" Benchmarks for rabbittop, run them from the repository root, e.g.
+
+    python -m benchmarks.queue_memory
+"""
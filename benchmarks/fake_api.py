@@ -0,0 +1,201 @@
+""" A local stand-in for the RabbitMQ management API.
+
+Serves synthetic /api/overview, /api/nodes, /api/queues, /api/exchanges,
+/api/bindings, /api/connections and /api/channels payloads with a
+configurable number of queues, and a tenth as many connections, and an
+artificial latency per request. The queue listing alternates between two ticks, so every refresh sees about
+one in ten queues change. rabbittop itself can be pointed at it as well:
+
+    python -m benchmarks.fake_api [QUEUE_COUNT] [LATENCY] [PORT]
+    rabbittop 127.0.0.1 -p PORT
+"""
+import BaseHTTPServer
+import SocketServer
+import json
+import re
+import sys
+import threading
+import time
+import urllib
+import urlparse
+
+from benchmarks import synthetic
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        api = self.server.api
+        url = urlparse.urlparse(self.path)
+        if api.latency:
+            time.sleep(api.latency)
+
+        if url.path == '/api/overview':
+            body = json.dumps(synthetic.overview(api.queue_count, api.tick))
+        elif url.path == '/api/nodes':
+            body = json.dumps(synthetic.nodes(api.node_count, api.tick))
+        elif url.path.startswith('/api/nodes/'):
+            nodes = [node for node in synthetic.nodes(api.node_count, api.tick)
+                     if node['name'] == urllib.unquote(url.path[len('/api/nodes/'):])]
+            if not nodes:
+                return self._error(404)
+            if urlparse.parse_qs(url.query).get('memory') == ['true']:
+                nodes[0]['memory'] = synthetic.memory(api.tick)
+            body = json.dumps(nodes[0])
+        elif url.path.startswith('/api/exchanges'):
+            body = json.dumps(synthetic.exchanges(tick=api.tick))
+        elif url.path.startswith('/api/bindings'):
+            body = json.dumps(synthetic.bindings(api.queue_count))
+        elif url.path.startswith('/api/connections') or url.path.startswith('/api/channels'):
+            listing = synthetic.connections if url.path.startswith('/api/connections') else synthetic.channels
+            body = _page(listing(api.queue_count // 10, api.tick), urlparse.parse_qs(url.query))
+            if body is None:
+                return self._error(400)
+        elif url.path.startswith('/api/queues'):
+            body = api.queues(urlparse.parse_qs(url.query))
+            if body is None:
+                return self._error(400)
+        else:
+            return self._error(404)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeAPI(object):
+    """ Serve synthetic management API payloads from a background thread.
+
+    The full queue listings of both ticks are serialized up front so that
+    the server is not what a benchmark measures; pages (RabbitMQ 3.6+
+    paging, with sort, sort_reverse, name and use_regex) are built on
+    demand.
+    """
+
+    def __init__(self, queue_count, node_count=3, latency=0, port=0):
+        self.queue_count = queue_count
+        self.node_count = node_count
+        self.latency = latency
+        self.tick = 0
+        self.requests = 0
+        self._listings = [json.dumps(synthetic.queues(queue_count, tick)) for tick in (0, 1)]
+        self._lock = threading.Lock()
+        self._server = _Server(('127.0.0.1', port), _Handler)
+        self._server.api = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def queues(self, query):
+        """ Return the serialized queue listing, or None for a page past the end.
+
+        Every full listing moves the payloads on to the next tick.
+        """
+        with self._lock:
+            self.requests += 1
+            if 'page' not in query:
+                self.tick = self.requests % 2
+                return self._listings[self.tick]
+
+        page = int(query['page'][0])
+        page_size = int(query.get('page_size', ['100'])[0])
+        if 'sort' in query or 'name' in query:
+            queues = synthetic.queues(self.queue_count, self.tick)
+            if 'name' in query:
+                pattern = query['name'][0]
+                if query.get('use_regex', ['false'])[0] != 'true':
+                    pattern = re.escape(pattern)
+                queues = [queue for queue in queues if re.search(pattern, queue['name'])]
+            if 'sort' in query:
+                queues.sort(key=lambda queue: _field(queue, query['sort'][0]),
+                            reverse=query.get('sort_reverse', ['false'])[0] == 'true')
+        else:
+            queues = None
+        count = self.queue_count if queues is None else len(queues)
+
+        page_count = max((count + page_size - 1) // page_size, 1)
+        if page > page_count:
+            return None
+        first = (page - 1) * page_size
+        if queues is None:
+            items = [synthetic.queue_data(index, self.tick) for index in range(first, min(first + page_size, count))]
+        else:
+            items = queues[first:first + page_size]
+        return json.dumps({
+            'items': items,
+            'filtered_count': count,
+            'item_count': self.queue_count,
+            'page': page,
+            'page_count': page_count,
+            'page_size': page_size,
+        })
+
+
+def _page(items, query):
+    """ Return the serialized items, sorted and paged as the query asks, or None for a page past the end.
+    """
+    if 'sort' in query:
+        items.sort(key=lambda item: _field(item, query['sort'][0]),
+                   reverse=query.get('sort_reverse', ['false'])[0] == 'true')
+    if 'page' not in query:
+        return json.dumps(items)
+    page = int(query['page'][0])
+    page_size = int(query.get('page_size', ['100'])[0])
+    page_count = max((len(items) + page_size - 1) // page_size, 1)
+    if page > page_count:
+        return None
+    return json.dumps({
+        'items': items[(page - 1) * page_size:page * page_size],
+        'filtered_count': len(items),
+        'item_count': len(items),
+        'page': page,
+        'page_count': page_count,
+        'page_size': page_size,
+    })
+
+
+def _field(queue, field):
+    for key in field.split('.'):
+        queue = queue.get(key) if isinstance(queue, dict) else None
+    return queue
+
+
+def run():
+    queue_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0
+    port = int(sys.argv[3]) if len(sys.argv) > 3 else 15672
+    api = FakeAPI(queue_count, latency=latency, port=port).start()
+    print('Serving %d queues on 127.0.0.1:%d with %gs latency, stop with ctrl-c' % (queue_count, api.port, latency))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        api.stop()
+
+
+if __name__ == '__main__':
+    run()
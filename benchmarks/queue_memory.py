@@ -0,0 +1,92 @@
+""" Measure the memory used per RabbitQueue.
+
+Compares the current RabbitQueue with the previous layout, which kept every
+value twice (flat attributes and a nested messages dict) in a per instance
+__dict__.
+
+    python -m benchmarks.queue_memory [QUEUE_COUNT]
+"""
+import sys
+
+from benchmarks.synthetic import queue_data
+from rabbittop import _rabbitmq
+
+
+class DictRabbitQueue(object):
+    """ The RabbitQueue layout before __slots__ were introduced.
+    """
+    def __init__(self, queue_data, timestamp=None):
+        self.name = queue_data.get('name')
+        self.vhost = queue_data.get('vhost')
+        self.state = queue_data.get('state')
+        self.policy = ''
+        self.exclusive = ''
+        self.params = ''
+        self.total = queue_data.get('messages')
+        self.total_rate = queue_data.get('messages_details', {'rate': 'N/A'})['rate']
+        self.ready = queue_data.get('messages_ready')
+        self.ready_rate = queue_data.get('messages_ready_details', {'rate': 'N/A'})['rate']
+        self.unacked = queue_data.get('messages_unacknowledged')
+        self.unacked_rate = queue_data.get('messages_unacknowledged_details', {'rate': 'N/A'})['rate']
+        self.messages = {
+            'total': {
+                'count': queue_data.get('messages'),
+                'rate': queue_data.get('messages_details', {'rate': 'N/A'})['rate']
+            },
+            'ready': {
+                'count': queue_data.get('messages_ready'),
+                'rate': queue_data.get('messages_ready_details', {'rate': 'N/A'})['rate']
+            },
+            'unacknowledged': {
+                'count': queue_data.get('messages_unacknowledged'),
+                'rate': queue_data.get('messages_unacknowledged_details', {'rate': 'N/A'})['rate']
+            },
+        }
+
+
+def deep_size(objects):
+    """ Number of bytes reachable from objects, counting shared objects once.
+    """
+    seen = set()
+    size = 0
+    stack = list(objects)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        else:
+            if hasattr(obj, '__dict__'):
+                stack.append(obj.__dict__)
+            for slot in getattr(type(obj), '__slots__', ()):
+                if hasattr(obj, slot):
+                    stack.append(getattr(obj, slot))
+    return size
+
+
+def bytes_per_queue(queue_class, count, *args):
+    # Interned literals like '' and 'N/A' exist regardless of the queues
+    baseline = deep_size(['', 'N/A', _rabbitmq.NOT_AVAILABLE])
+    queues = [queue_class(queue_data(index), None, *args) for index in range(count)]
+    return float(deep_size(queues) - baseline) / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    before = bytes_per_queue(DictRabbitQueue, count)
+    # The queues of a cluster share one history, the columns are counted with them
+    history = _rabbitmq.queue_history()
+    after = bytes_per_queue(_rabbitmq.RabbitQueue, count, history)
+    print('%d queues' % count)
+    print('before: %8.1f bytes/queue' % before)
+    print('after:  %8.1f bytes/queue (%.0f%% less)' % (after, 100 - after / before * 100))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+""" Time the stages of a refresh against the local fake management API.
+
+For every queue count a FakeAPI is started and refreshed a number of
+times. Each refresh is split into its stages: fetching the raw payloads
+(fetch), decoding them (parse), updating the Rabbit, Node and RabbitQueue
+objects (model) and drawing a frame (render). The streamed refresh that
+the poller runs, with fetching, decoding and the model update overlapped,
+is timed as a whole (refresh). Drawing happens in a pseudo terminal.
+
+    python -m benchmarks.refresh [QUEUE_COUNTS] [REFRESHES] [LATENCY]
+
+e.g. python -m benchmarks.refresh 1000,10000,100000 5 0.01
+"""
+import collections
+import curses
+import json
+import os
+import pty
+import sys
+import time
+import urllib
+
+from benchmarks.fake_api import FakeAPI
+from rabbittop import _rabbitmq, main, terminal
+
+LINES = 50
+COLUMNS = 160
+
+STAGES = ('fetch', 'parse', 'model', 'render', 'refresh')
+
+
+def _fetch(client, path):
+    return client._send(client.host, 'GET', '/api/' + path, None, read=True)[2]
+
+
+def measure_refreshes(port, refreshes):
+    """ Return the timings of each stage in seconds, by stage name.
+    """
+    timings = collections.defaultdict(list)
+    paths = ('overview', 'nodes', 'queues/?' + urllib.urlencode({'columns': ','.join(_rabbitmq.QUEUE_COLUMNS)}))
+
+    def _run(scrn):
+        term = terminal.Terminal(scrn=scrn)
+        client = _rabbitmq.Client('127.0.0.1', 'guest', 'guest', port)
+        rabbit = _rabbitmq.Rabbit(client)
+        streamed = _rabbitmq.Rabbit(client)
+        for _ in range(refreshes):
+            started = time.time()
+            payloads = [_fetch(client, path) for path in paths]
+            fetched = time.time()
+            _overview, nodes, queues = [json.loads(payload) for payload in payloads]
+            parsed = time.time()
+            rabbit._update_overview(_overview)
+            rabbit._update_nodes(nodes)
+            rabbit._update_queues(queues)
+            modelled = time.time()
+            main.draw(term, rabbit)
+            term.refresh()
+            rendered = time.time()
+            streamed.refresh()
+            refreshed = time.time()
+
+            timings['fetch'].append(fetched - started)
+            timings['parse'].append(parsed - fetched)
+            timings['model'].append(modelled - parsed)
+            timings['render'].append(rendered - modelled)
+            timings['refresh'].append(refreshed - rendered)
+            del payloads, _overview, nodes, queues
+        client.close()
+
+    curses.wrapper(_run)
+    return timings
+
+
+def measure(queue_count, refreshes, latency=0):
+    """ Run measure_refreshes in a pseudo terminal against a FakeAPI with queue_count queues.
+    """
+    api = FakeAPI(queue_count, latency=latency).start()
+    read_results, write_results = os.pipe()
+    pid, fd = pty.fork()
+    if pid == 0:
+        os.environ.update({'TERM': 'xterm', 'LINES': str(LINES), 'COLUMNS': str(COLUMNS)})
+        try:
+            os.write(write_results, json.dumps(measure_refreshes(api.port, refreshes)))
+        finally:
+            os._exit(0)
+
+    os.close(write_results)
+    # The terminal output has to be drained for the child to make progress
+    while True:
+        try:
+            if not os.read(fd, 65536):
+                break
+        except OSError:
+            break
+    os.waitpid(pid, 0)
+    results = ''
+    while True:
+        data = os.read(read_results, 65536)
+        if not data:
+            break
+        results += data
+    os.close(read_results)
+    api.stop()
+    return json.loads(results) if results else None
+
+
+def run():
+    queue_counts = [int(count) for count in (sys.argv[1] if len(sys.argv) > 1 else '1000,10000').split(',')]
+    refreshes = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0
+
+    print('%d refreshes, %gs api latency, times in ms (min/median/max)' % (refreshes, latency))
+    print('%8s  %s' % ('queues', '  '.join('%-20s' % stage for stage in STAGES)))
+    for queue_count in queue_counts:
+        timings = measure(queue_count, refreshes, latency)
+        if not timings:
+            print('%8d  failed' % queue_count)
+            continue
+        columns = []
+        for stage in STAGES:
+            values = sorted(timings[stage])
+            columns.append('%-20s' % ('%.1f/%.1f/%.1f' % (
+                values[0] * 1000, values[len(values) // 2] * 1000, values[-1] * 1000)))
+        print('%8d  %s' % (queue_count, '  '.join(columns)))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,89 @@
+""" Count the bytes rabbittop writes to the terminal per frame.
+
+Frames of a synthetic cluster are drawn into a pseudo terminal, the output
+is split per frame and reported together with the number of rows that
+had to be rewritten in the curses windows.
+
+    python -m benchmarks.render_bytes [QUEUE_COUNT] [FRAMES]
+"""
+import curses
+import os
+import pty
+import re
+import sys
+
+from benchmarks import synthetic
+from rabbittop import _rabbitmq, main, terminal
+
+LINES = 50
+COLUMNS = 160
+
+# A window title escape sequence marks the end of each frame in the output
+_frame_marker = re.compile(r'\x1b\]2;frame (\d+) (\d+)\x07')
+
+
+def render(queue_count, frames):
+    def _run(scrn):
+        term = terminal.Terminal(scrn=scrn)
+        client = synthetic.StaticClient(queue_count)
+        rabbit = _rabbitmq.Rabbit(client)
+        for frame in range(frames):
+            rabbit.refresh()
+            main.draw(term, rabbit)
+            term.refresh()
+            rows = term._frame.rows_written
+            os.write(sys.stdout.fileno(), '\x1b]2;frame %d %d\x07' % (frame, rows))
+            client.next_tick()
+
+    curses.wrapper(_run)
+
+
+def measure(queue_count, frames):
+    """ Return a list of (bytes, rows rewritten) per frame.
+    """
+    pid, fd = pty.fork()
+    if pid == 0:
+        os.environ.update({'TERM': 'xterm', 'LINES': str(LINES), 'COLUMNS': str(COLUMNS)})
+        try:
+            render(queue_count, frames)
+        finally:
+            os._exit(0)
+
+    output = []
+    while True:
+        try:
+            data = os.read(fd, 65536)
+        except OSError:
+            break
+        if not data:
+            break
+        output.append(data)
+    os.waitpid(pid, 0)
+
+    output = ''.join(output)
+    results = []
+    start = 0
+    for match in _frame_marker.finditer(output):
+        results.append((match.start() - start, int(match.group(2))))
+        start = match.end()
+    return results
+
+
+def run():
+    queue_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    frames = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    results = measure(queue_count, frames)
+    if not results:
+        print('No frames were rendered')
+        return
+
+    print('%d queues, %d frames on a %dx%d terminal' % (queue_count, len(results), COLUMNS, LINES))
+    print('first frame: %6d bytes, %4d rows written' % results[0])
+    if len(results) > 1:
+        later = results[1:]
+        print('next frames: %6d bytes, %4d rows written on average' % (
+            sum(size for size, _ in later) / len(later), sum(rows for _, rows in later) / len(later)))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,76 @@
+""" Time the evaluation of the queue thresholds.
+
+The queues of a synthetic cluster are evaluated against the default
+rules and against rules with thresholds per queue filter, from the
+columns of their metrics. The first evaluation matches every queue
+against the filters, the next ones reuse the rule sets they matched.
+Alerts, which the poller updates after every refresh, only evaluate the
+queues in its Changeset (update).
+
+    python -m benchmarks.rules [QUEUE_COUNTS] [EVALUATIONS]
+
+e.g. python -m benchmarks.rules 1000,10000,100000 10
+"""
+import sys
+import time
+
+from benchmarks import synthetic
+from rabbittop import _rabbitmq, queue_view, rules
+from rabbittop.poller import Snapshot
+
+
+def filtered_rules():
+    return rules.Rules({'queues': {'total_rate': (50, 100)}}, [
+        (queue_view.Filter('vhost:-0$'), {'ready': (10, 100)}),
+        (queue_view.Filter(r'\.1\d*$ state:idle'), {'unacked': (5, 50), 'unacked_rate': (1, 10)}),
+    ])
+
+
+def measure(queue_count, evaluations):
+    """ Return the seconds of the first and the average of the next evaluations and Alerts updates, with the
+    number of warnings and errors, by rules name.
+    """
+    client = synthetic.StaticClient(queue_count)
+    rabbit = _rabbitmq.Rabbit(client)
+    rabbit.refresh()
+    queues = rabbit.all_queues
+    slots = [queue.slot for queue in queues]
+    results = {}
+    for name, rule_set in (('default', rules.Rules()), ('filtered', filtered_rules())):
+        durations = []
+        matched = None
+        for _ in range(evaluations):
+            started = time.time()
+            if matched is None:
+                matched = rule_set.match(queues)
+            rule_set.evaluate(rabbit.queue_columns, slots, matched)
+            durations.append(time.time() - started)
+        later = durations[1:] or durations
+
+        alerts = rules.Alerts(rule_set)
+        alerts.update(rabbit, Snapshot(0, 0, 0, _rabbitmq.Changeset(queues, [], [])))
+        updates = []
+        for generation in range(evaluations):
+            client.next_tick()
+            changeset = rabbit.refresh()
+            started = time.time()
+            alerts.update(rabbit, Snapshot(generation, 0, 0, changeset))
+            updates.append(time.time() - started)
+        results[name] = (durations[0], sum(later) / len(later), sum(updates) / len(updates), alerts.counts[1],
+                         alerts.counts[2])
+    return results
+
+
+def run():
+    queue_counts = [int(count) for count in (sys.argv[1] if len(sys.argv) > 1 else '1000,10000,100000').split(',')]
+    evaluations = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    print('%10s %10s %10s %10s %10s %10s %10s' % ('queues', 'rules', 'first ms', 'next ms', 'update ms', 'warnings',
+                                                  'errors'))
+    for queue_count in queue_counts:
+        for name, (first, later, update, warnings, errors) in sorted(measure(queue_count, evaluations).items()):
+            print('%10d %10s %10.1f %10.1f %10.1f %10d %10d' % (queue_count, name, first * 1000, later * 1000,
+                                                               update * 1000, warnings, errors))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,186 @@
+""" Synthetic management API payloads for the benchmarks.
+"""
+import io
+import json
+
+from rabbittop import _rabbitmq
+
+
+def queue_data(index, tick=0):
+    """ An /api/queues entry, decoded the same way json.loads would.
+
+    About one in ten queues changes its counters every tick.
+    """
+    changing = tick if index % 10 == 0 else 0
+    data = {
+        u'name': u'queue.%d' % index,
+        u'vhost': u'/vhost-%d' % (index % 4),
+        u'state': u'running' if index % 3 else u'idle',
+        u'policy': u'ha-all' if index % 5 == 0 else u'',
+        u'exclusive': False,
+        u'arguments': {},
+        u'messages': (index + changing) % 1000,
+        u'messages_ready': (index + changing) % 700,
+        u'messages_unacknowledged': index % 300,
+    }
+    if index % 2:
+        data[u'messages_details'] = {u'rate': float((index + changing) % 50)}
+        data[u'messages_ready_details'] = {u'rate': float(index % 30)}
+        data[u'messages_unacknowledged_details'] = {u'rate': float(index % 20)}
+    return data
+
+
+def queues(count, tick=0):
+    return [queue_data(index, tick) for index in range(count)]
+
+
+def node_data(index, tick=0):
+    return {
+        u'name': u'rabbit@node-%d' % index,
+        u'type': u'disc',
+        u'running': True,
+        u'os_pid': u'%d' % (1000 + index),
+        u'fd_used': 100 + tick % 10,
+        u'fd_total': 65536,
+        u'sockets_used': 80 + tick % 10,
+        u'sockets_total': 58890,
+        u'mem_used': 512 * 1024 * 1024 + tick * 4096,
+        u'mem_limit': 3 * 1024 * 1024 * 1024,
+        u'mem_alarm': False,
+        u'disk_free_limit': 50 * 1024 * 1024,
+        u'disk_free': 20 * 1024 * 1024 * 1024,
+        u'disk_free_alarm': False,
+        u'proc_used': 900 + tick % 10,
+        u'proc_total': 1048576,
+        u'uptime': 3600000 + tick * 3000,
+    }
+
+
+def memory(tick=0):
+    """ The memory breakdown of a node as sent with ?memory=true (3.7+).
+    """
+    mb = 1024 * 1024
+    breakdown = {
+        u'connection_readers': 12 * mb, u'connection_writers': 3 * mb, u'connection_channels': 20 * mb,
+        u'connection_other': 15 * mb, u'queue_procs': 150 * mb + tick * 4096, u'queue_slave_procs': 40 * mb,
+        u'plugins': 10 * mb, u'other_proc': 30 * mb, u'metrics': 8 * mb, u'mgmt_db': 25 * mb, u'mnesia': 2 * mb,
+        u'other_ets': 6 * mb, u'binary': 120 * mb, u'msg_index': 4 * mb, u'code': 28 * mb, u'atom': 1 * mb,
+        u'other_system': 18 * mb, u'allocated_unused': 20 * mb, u'reserved_unallocated': 0,
+    }
+    breakdown[u'total'] = {u'erlang': sum(breakdown.values()), u'rss': sum(breakdown.values()),
+                           u'allocated': sum(breakdown.values())}
+    breakdown[u'strategy'] = u'rss'
+    return breakdown
+
+
+def nodes(count, tick=0):
+    return [node_data(index, tick) for index in range(count)]
+
+
+def overview(queue_count, tick=0):
+    return {
+        u'rabbitmq_version': u'3.6.16',
+        u'erlang_version': u'19.3',
+        u'cluster_name': u'rabbit@benchmark',
+        u'queue_totals': {
+            u'messages': queue_count * 500 + tick,
+            u'messages_details': {u'rate': 12.5},
+            u'messages_ready': queue_count * 350 + tick,
+            u'messages_ready_details': {u'rate': 10.0},
+            u'messages_unacknowledged': queue_count * 150,
+            u'messages_unacknowledged_details': {u'rate': 2.5},
+        },
+        u'object_totals': {u'queues': queue_count, u'consumers': queue_count, u'connections': 10,
+                           u'channels': 20, u'exchanges': 12},
+        u'message_stats': {u'publish_details': {u'rate': 120.0}, u'confirm_details': {u'rate': 118.0}},
+    }
+
+
+def exchanges(vhost_count=4, tick=0):
+    """ The default, amq.direct and an events exchange per vhost, only events is published to.
+    """
+    data = []
+    for index in range(vhost_count):
+        vhost = u'/vhost-%d' % index
+        data.append({u'name': u'', u'vhost': vhost, u'type': u'direct'})
+        data.append({u'name': u'amq.direct', u'vhost': vhost, u'type': u'direct'})
+        data.append({u'name': u'events', u'vhost': vhost, u'type': u'topic', u'message_stats': {
+            u'publish_in_details': {u'rate': float(10 + tick % 5)},
+            u'publish_out_details': {u'rate': float(20 + tick % 5)},
+        }})
+    return data
+
+
+def bindings(queue_count):
+    """ Every queue bound to the default exchange, and every seventh one to events as well.
+    """
+    data = []
+    for index in range(queue_count):
+        queue = queue_data(index)
+        data.append({u'source': u'', u'vhost': queue[u'vhost'], u'destination': queue[u'name'],
+                     u'destination_type': u'queue'})
+        if index % 7 == 0:
+            data.append({u'source': u'events', u'vhost': queue[u'vhost'], u'destination': queue[u'name'],
+                         u'destination_type': u'queue'})
+    return data
+
+
+def connections(count, tick=0):
+    """ Connections from one host in 50 and one user in 20, two channels each.
+    """
+    return [{
+        u'name': u'10.0.0.%d:%d -> 10.0.0.1:5672' % (index % 50, 40000 + index),
+        u'user': u'service-%d' % (index % 20),
+        u'peer_host': u'10.0.0.%d' % (index % 50),
+        u'channels': 2,
+        u'recv_oct_details': {u'rate': float((index * 37 + tick) % 4096)},
+        u'send_oct_details': {u'rate': float((index * 17 + tick) % 2048)},
+    } for index in range(count)]
+
+
+def channels(count, tick=0):
+    """ Channels of the connections, a few of them with a pile of unacknowledged messages.
+    """
+    return [{
+        u'name': u'10.0.0.%d:%d -> 10.0.0.1:5672 (%d)' % (index // 2 % 50, 40000 + index // 2, index % 2 + 1),
+        u'user': u'service-%d' % (index // 2 % 20),
+        u'vhost': u'/vhost-%d' % (index % 4),
+        u'messages_unacknowledged': (index * 7919 + tick) % 1000 if index % 13 == 0 else index % 3,
+        u'prefetch_count': (10, 100, 0)[index % 3],
+        u'consumer_count': index % 2,
+        u'message_stats': {
+            u'publish_details': {u'rate': float(index % 40)},
+            u'deliver_get_details': {u'rate': float((index + tick) % 30)},
+            u'ack_details': {u'rate': float((index + tick) % 30)},
+        },
+    } for index in range(count)]
+
+
+class StaticClient(object):
+    """ Stand-in for _rabbitmq.Client that answers from synthetic payloads.
+
+    Call next_tick() to move the payloads on to the next refresh.
+    """
+
+    def __init__(self, queue_count, node_count=3):
+        self.queue_count = queue_count
+        self.node_count = node_count
+        self.tick = 0
+        self._queues = json.dumps(queues(queue_count))
+
+    def next_tick(self):
+        self.tick += 1
+        self._queues = json.dumps(queues(self.queue_count, self.tick))
+
+    def request(self, path, data=None, method='GET', host=None):
+        if path.startswith('overview'):
+            return overview(self.queue_count, self.tick)
+        if path.startswith('nodes'):
+            return nodes(self.node_count, self.tick)
+        return json.loads(self._queues)
+
+    def stream(self, path, items_key='items', host=None):
+        return _rabbitmq.JSONStream(io.BytesIO(self._queues).read, items_key=items_key)
+
+    def close(self):
+        pass
@@ -4,112 +4,955 @@
 import httplib
 import base64
 import os
+import re
 import json
+import socket
+import threading
 import collections
 import datetime
+import heapq
+import time
+import urllib
 
 import logging
 
+from rabbittop.history import ColumnarHistory, MetricHistory, RingBuffer
+from rabbittop.queue_view import API_SORT_FIELDS, Filter, QueueView
+from rabbittop.timing import TimedIterator
+
 _log = logging.getLogger()
 
+NOT_AVAILABLE = 'N/A'
+
+# A value of the metric columns of the queues that is not a number (N/A or missing), it is below every threshold
+MISSING = float('-inf')
+
+# Number of refreshes the message counts are kept for to compute rates
+RATE_SAMPLES = 8
+
+# Default number of refreshes node history is kept for at full resolution
+NODE_HISTORY = 60
+
+# Number of samples averaged into one point of the low resolution history
+DOWNSAMPLE = 10
+
+_whitespace = re.compile(r'\s*')
+
+# The queue fields rabbittop displays, requested instead of the full queue documents
+QUEUE_COLUMNS = [
+    'name', 'vhost', 'state', 'policy', 'exclusive', 'arguments',
+    'messages', 'messages_details.rate',
+    'messages_ready', 'messages_ready_details.rate',
+    'messages_unacknowledged', 'messages_unacknowledged_details.rate',
+]
+
+# The parts of the model that are fetched separately, by their endpoint
+SECTIONS = ('overview', 'nodes', 'queues')
+
+# Largest page size the api accepts
+MAX_PAGE_SIZE = 500
+
+# Fields the top mode ranks queues by: the api field and the RabbitQueue attribute it ends up in
+TOP_FIELDS = collections.OrderedDict([
+    ('ready', ('messages_ready', 'ready')),
+    ('unacked', ('messages_unacknowledged', 'unacked')),
+    ('rate', ('messages_details.rate', 'total_rate')),
+])
+
+# The exchange fields the exchanges view shows
+EXCHANGE_COLUMNS = [
+    'name', 'vhost', 'type',
+    'message_stats.publish_in_details.rate', 'message_stats.publish_out_details.rate',
+]
+
+# The binding fields needed to know where exchanges route to
+BINDING_COLUMNS = ['source', 'vhost', 'destination', 'destination_type']
+
+# Seconds the exchange and binding listings are cached for
+TOPOLOGY_TTL = 60
+
+# The connection fields the connections view aggregates
+CONNECTION_COLUMNS = ['user', 'peer_host', 'channels', 'recv_oct_details.rate', 'send_oct_details.rate']
+
+# The channel fields the channels view shows
+CHANNEL_COLUMNS = [
+    'name', 'user', 'vhost', 'messages_unacknowledged', 'prefetch_count', 'consumer_count',
+    'message_stats.publish_details.rate', 'message_stats.deliver_get_details.rate', 'message_stats.ack_details.rate',
+]
+
+# What the top channels can be ordered by: the api field
+CHANNEL_ORDERS = collections.OrderedDict([
+    ('unacked', 'messages_unacknowledged'),
+    ('prefetch', 'prefetch_count'),
+    ('publish', 'message_stats.publish_details.rate'),
+    ('deliver', 'message_stats.deliver_get_details.rate'),
+])
+
+# Number of top channels kept
+TOP_CHANNELS = 100
+
+# Pages of connections aggregated at most, to bound a connection storm
+MAX_CONNECTION_PAGES = 100
+
+# Seconds the connection and channel listings are cached for while they are shown
+ACTIVITY_TTL = 5
+
+# Seconds the memory breakdown of a node is cached for
+NODE_DETAIL_TTL = 10
+
+# Seconds a management listener that failed is skipped for, doubled on every consecutive failure
+HOST_RETRY = 5
+MAX_HOST_RETRY = 300
+
 # Use urllib.extra_quote to deal with weird names
 
-def overview(host, user, password, port):
-    return dict(_create_http_client(host, user, password, port, 'overview'))
+def overview(client):
+    return dict(client.request('overview'))
 
-def status(host, user, password, port, node_name=None):
+def status(client, node_name=None, host=None):
     """ Return the status of the rabbitmq node.
     """
     if node_name:
-        return dict(_create_http_client(host, user, password, port, 'nodes/{0}?memory=true'.format(node_name)))
+        return dict(client.request('nodes/{0}?memory=true'.format(node_name), host=host))
 
-    return _create_http_client(host, user, password, port, 'nodes')
+    return client.request('nodes', host=host)
 
 
-def list_exchanges(host, user, password, port, vhost=''):
+def list_exchanges(client, vhost='', columns=None):
     """  List all the exchanges in a given vhost
     """
+    path = 'exchanges/{0}'.format(vhost)
+    if columns:
+        path += '?' + urllib.urlencode({'columns': ','.join(columns)})
     return_values = collections.defaultdict(dict)
-    for exchange in _create_http_client(host, user, password, port, 'exchanges/{0}'.format(vhost)):
+    for exchange in client.request(path):
         return_values[exchange.pop('vhost')][exchange.pop('name')] = exchange
     return dict(return_values)
 
 
-def list_queues(host, user, password, port, vhost='', name=''):
+def list_bindings(client, vhost='', columns=None, stream=False):
+    """ List all the bindings in a given vhost
+
+    With `stream` a JSONStream is returned that yields the bindings as they
+    arrive, there is one for every queue to the default exchange.
+    """
+    path = 'bindings/{0}'.format(vhost)
+    if columns:
+        path += '?' + urllib.urlencode({'columns': ','.join(columns)})
+    if stream:
+        return client.stream(path)
+    return client.request(path)
+
+
+def list_queues(client, vhost='', name='', columns=None, page=None, page_size=None, sort=None,
+                sort_reverse=False, name_regex=None, stream=False):
     """ List all the queues in a given vhost
+
+    `columns` limits the fields returned for each queue. When `page` is given
+    the API (RabbitMQ 3.6+) returns a dict with one page of queues in `items`
+    and the `filtered_count` and `page_count` of the whole listing, the
+    listing can then be filtered with `name_regex`. With `stream` a
+    JSONStream is returned that yields the queues as they arrive.
+    """
+    return _list(client, 'queues/{0}/{1}'.format(vhost, name), columns, page, page_size, sort, sort_reverse,
+                 name_regex, stream)
+
+
+def list_connections(client, vhost='', columns=None, page=None, page_size=None, sort=None, sort_reverse=False,
+                     stream=False):
+    """ List all the connections, or those of a given vhost
+
+    Takes the same `columns`, paging, sorting and `stream` arguments as list_queues.
     """
-    return _create_http_client(host, user, password, port, 'queues/{0}/{1}'.format(vhost, name))
+    path = 'vhosts/{0}/connections'.format(vhost) if vhost else 'connections'
+    return _list(client, path, columns, page, page_size, sort, sort_reverse, None, stream)
 
 
-def _create_http_client(host, user, password, port, path, data=None, method='GET'):
-    """ Create a http client that will talk to the RabbitMQ http API.
+def list_channels(client, vhost='', columns=None, page=None, page_size=None, sort=None, sort_reverse=False,
+                  stream=False):
+    """ List all the channels, or those of a given vhost
+
+    Takes the same `columns`, paging, sorting and `stream` arguments as list_queues.
     """
-    if data:
-        data = json.dumps(data)
+    path = 'vhosts/{0}/channels'.format(vhost) if vhost else 'channels'
+    return _list(client, path, columns, page, page_size, sort, sort_reverse, None, stream)
+
+
+def _list(client, path, columns, page, page_size, sort, sort_reverse, name_regex, stream):
+    params = []
+    if columns:
+        params.append(('columns', ','.join(columns)))
+    if page:
+        params.append(('page', page))
+        params.append(('page_size', page_size))
+        if name_regex:
+            params.append(('name', name_regex))
+            params.append(('use_regex', 'true'))
+    if sort:
+        params.append(('sort', sort))
+        params.append(('sort_reverse', 'true' if sort_reverse else 'false'))
+    if params:
+        path += '?' + urllib.urlencode(params)
+    if stream:
+        return client.stream(path)
+    return client.request(path)
+
+
+def fetch_top(listing, client, vhost, columns, field, count):
+    """ Return the top count items of a listing (list_queues, list_channels, ...) by a dotted api field, largest first.
+
+    The api (3.6+) is asked for just enough pages of items sorted by the
+    field, older versions ignore that and return all items. Either way only
+    a heap of the top items is kept while the listing is decoded.
+    """
+    page_size = min(count, MAX_PAGE_SIZE)
+    heap = []
+    position = 0
+    for page in range(1, (count + page_size - 1) // page_size + 1):
+        result = listing(client, vhost, columns=columns, page=page, page_size=page_size, sort=field,
+                         sort_reverse=True, stream=True)
+        for item in result:
+            # The position breaks ties, items that come first rank higher
+            position -= 1
+            entry = (_field(item, field), position, item)
+            if len(heap) < count:
+                heapq.heappush(heap, entry)
+            else:
+                heapq.heappushpop(heap, entry)
+        # A list instead of a page means the server returned all items at once
+        document = getattr(result, 'document', None)
+        if not isinstance(document, dict) or page >= document.get('page_count', page):
+            break
+    return [item for _, _, item in sorted(heap, reverse=True)]
+
+
+def fetch_concurrently(calls, timeout=None, durations=None):
+    """ Run API calls in parallel threads and return their results by key.
+
+    `calls` maps a key to a (function, args) tuple. A call that raises or
+    does not finish within `timeout` seconds results in None, so callers
+    can still use whatever did arrive. The seconds each call took, or ran
+    until the timeout, are stored by key in the `durations` dict if given.
+    """
+    results = {}
+    started = time.time()
+
+    def _worker(key, function, args):
+        try:
+            results[key] = function(*args)
+        except Exception:
+            _log.debug('Fetching %s failed', key, exc_info=True)
+        finally:
+            if durations is not None:
+                durations[key] = time.time() - started
+
+    threads = []
+    for key, (function, args) in calls.items():
+        thread = threading.Thread(target=_worker, args=(key, function, args))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
 
-    conn = httplib.HTTPConnection(host, port=int(port))
-    credentials = base64.encodestring('{0}:{1}'.format(user, password)).replace('\n', '')
-    headers = {
-        'Authorization': "Basic {0}".format(credentials),
-        'Content-Type': 'application/json'
-    }
-    _log.debug(os.path.join('/api', path))
-    conn.request(method, os.path.join('/api', path), data, headers)
-    result = conn.getresponse()
-    result = result.read()
+    deadline = time.time() + timeout if timeout else None
+    for thread in threads:
+        thread.join(max(deadline - time.time(), 0) if deadline else None)
 
-    return json.loads(result) if result else None
+    if durations is not None:
+        for key in calls:
+            durations.setdefault(key, time.time() - started)
+    return dict((key, results.get(key)) for key in calls)
+
+
+class HostPool(object):
+    """ The management listeners of a cluster and their health.
+
+    The pool starts with the seed hosts, the nodes of the cluster can be
+    added with set_nodes. Requests go round robin to the hosts that are up.
+    A host that fails is skipped for HOST_RETRY seconds, doubled on every
+    consecutive failure up to MAX_HOST_RETRY, and is tried last while it is
+    down, so the cluster is never given up on entirely.
+    """
+
+    def __init__(self, seeds, clock=time.time):
+        self._seeds = list(seeds)
+        self._clock = clock
+        self._hosts = list(self._seeds)
+        # Node name by host, for the hosts that were discovered
+        self._nodes = {}
+        self._failures = dict.fromkeys(self._hosts, 0)
+        self._retry_at = dict.fromkeys(self._hosts, 0)
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def set_nodes(self, node_names):
+        """ Use the management listeners of the nodes, named like rabbit@host, next to the seed hosts.
+        """
+        nodes = dict((name.partition('@')[2], name) for name in node_names if '@' in name)
+        with self._lock:
+            self._nodes = nodes
+            self._hosts = self._seeds + sorted(host for host in nodes if host not in self._seeds)
+            for host in self._hosts:
+                self._failures.setdefault(host, 0)
+                self._retry_at.setdefault(host, 0)
+
+    def candidates(self):
+        """ Return the hosts to try a request on in order, the hosts that are up first.
+        """
+        now = self._clock()
+        with self._lock:
+            self._next = (self._next + 1) % len(self._hosts)
+            hosts = self._hosts[self._next:] + self._hosts[:self._next]
+            up = [host for host in hosts if self._retry_at[host] <= now]
+            down = sorted((host for host in hosts if self._retry_at[host] > now), key=self._retry_at.get)
+        return up + down
+
+    def host_of(self, node_name):
+        """ Return the host of the management listener of a node while it is up, else None.
+        """
+        host = node_name.partition('@')[2]
+        with self._lock:
+            if host in self._nodes and self._retry_at[host] <= self._clock():
+                return host
+        return None
+
+    def succeeded(self, host):
+        with self._lock:
+            if host in self._failures:
+                self._failures[host] = 0
+                self._retry_at[host] = 0
+
+    def failed(self, host):
+        with self._lock:
+            if host in self._failures:
+                self._failures[host] += 1
+                retry = min(HOST_RETRY * 2 ** (self._failures[host] - 1), MAX_HOST_RETRY)
+                self._retry_at[host] = self._clock() + retry
+
+    def health(self):
+        """ Return (host, up) for every host.
+        """
+        now = self._clock()
+        with self._lock:
+            return [(host, self._retry_at[host] <= now) for host in self._hosts]
+
+
+class Client(object):
+    """ Http client that talks to the RabbitMQ http API.
+
+    Connections are kept alive and pooled per host so consecutive refreshes
+    do not pay for a new TCP (and TLS) handshake, the request headers are
+    computed once. When `timings` is set the round trip (fetch) and the
+    json decoding (decode) of every call are added to it per endpoint.
+
+    `host` may list several comma separated management hosts of one
+    cluster. Requests that do not name a host are spread over the `hosts`
+    HostPool and fail over to the next host when one does not answer.
+    """
+
+    def __init__(self, host, user, password, port, use_ssl=False, timeout=None):
+        self.hosts = HostPool(host.split(','))
+        self.host = host.split(',')[0]
+        self.port = int(port)
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.timings = None
+        credentials = base64.b64encode('{0}:{1}'.format(user, password))
+        self._headers = {
+            'Authorization': "Basic {0}".format(credentials),
+            'Content-Type': 'application/json',
+            'Connection': 'keep-alive',
+        }
+        self._pool = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def request(self, path, data=None, method='GET', host=None):
+        """ Perform a request against the API and return the decoded json body.
+
+        A pooled connection that turns out to be closed by the server is
+        dropped and the request is retried once on a fresh connection.
+        """
+        if data:
+            data = json.dumps(data)
+
+        started = time.time()
+        _, conn, response, result = self._failover(host, method, os.path.join('/api', path), data, read=True)
+        fetched = time.time()
+        result = json.loads(result) if result else None
+        if self.timings:
+            endpoint = _endpoint(path)
+            self.timings.add('fetch ' + endpoint, fetched - started)
+            self.timings.add('decode ' + endpoint, time.time() - fetched)
+        return result
+
+    def stream(self, path, items_key='items', host=None):
+        """ Perform a GET request and return a JSONStream over the response.
+
+        The body is decoded while it is read from the socket, one element of
+        the (items_key) array at a time. The connection goes back to the pool
+        once the stream has been consumed.
+        """
+        started = time.time()
+        host, conn, response, _ = self._failover(host, 'GET', os.path.join('/api', path), None)
+        sent = time.time() - started
+
+        def _done(complete):
+            if complete:
+                self._release(host, conn, response)
+            else:
+                conn.close()
+            if self.timings:
+                endpoint = _endpoint(path)
+                self.timings.add('fetch ' + endpoint, sent + stream.read_time)
+                self.timings.add('decode ' + endpoint, stream.decode_time)
+
+        stream = JSONStream(response.read, items_key=items_key, done=_done, timed=self.timings is not None)
+        return stream
+
+    def _failover(self, host, method, url, data, read=False):
+        """ Send a request to host first if given, then to the hosts of the pool until one answers.
+
+        Returns the host that answered with the result of _send. Connection
+        errors and server errors (5xx) count as failures of the host, other
+        errors are the answer of a healthy host.
+        """
+        candidates = self.hosts.candidates()
+        if host:
+            candidates = [host] + [candidate for candidate in candidates if candidate != host]
+        for candidate in candidates:
+            try:
+                result = self._send(candidate, method, url, data, read=read)
+            except APIError as error:
+                if error.status < 500:
+                    self.hosts.succeeded(candidate)
+                    raise
+                last_error = error
+            except (httplib.HTTPException, socket.error) as error:
+                last_error = error
+            else:
+                self.hosts.succeeded(candidate)
+                return (candidate,) + result
+            _log.debug('Request to %s failed', candidate, exc_info=True)
+            self.hosts.failed(candidate)
+        raise last_error
+
+    def _send(self, host, method, url, data, read=False):
+        _log.debug(url)
+        while True:
+            conn, reused = self._acquire(host)
+            try:
+                conn.request(method, url, data, self._headers)
+                response = conn.getresponse()
+                result = response.read() if read or response.status >= 400 else None
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                if reused:
+                    continue
+                raise
+            break
+
+        if read or response.status >= 400:
+            self._release(host, conn, response)
+        if response.status >= 400:
+            raise APIError(response.status, response.reason, url)
+        return conn, response, result
+
+    def close(self):
+        """ Close all idle connections.
+        """
+        with self._lock:
+            for connections in self._pool.values():
+                for conn in connections:
+                    conn.close()
+            self._pool.clear()
+
+    def _acquire(self, host):
+        with self._lock:
+            if self._pool[host]:
+                return self._pool[host].pop(), True
+
+        connection_class = httplib.HTTPSConnection if self.use_ssl else httplib.HTTPConnection
+        return connection_class(host, port=self.port, timeout=self.timeout), False
+
+    def _release(self, host, conn, response):
+        if response.will_close:
+            conn.close()
+            return
+        with self._lock:
+            self._pool[host].append(conn)
+
+
+class JSONStream(object):
+    """ Incrementally decode a json document that is, or holds, one large array.
+
+    Iterating yields the elements of the top level array, or of the array
+    stored under `items_key` in a top level object. Only one element is
+    decoded at a time and the raw body is read in chunks, so memory stays
+    bounded by the largest element instead of the whole document. Once
+    iterated, `document` holds the rest of the top level object. When
+    `timed`, the time spent reading and decoding is summed in `read_time`
+    and `decode_time`.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, read, items_key='items', done=None, timed=False):
+        self._read = read
+        self._items_key = items_key
+        self._done = done
+        self._timed = timed
+        self.read_time = 0.0
+        self.decode_time = 0.0
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self.document = None
+
+    def __iter__(self):
+        complete = False
+        try:
+            for item in self._document():
+                yield item
+            complete = True
+        finally:
+            if self._done:
+                self._done(complete)
+
+    def _document(self):
+        if self._next(u'[{') == u'[':
+            self.document = []
+            for item in self._array():
+                yield item
+            return
+
+        self.document = {}
+        if self._peek() == u'}':
+            self._pos += 1
+            return
+        while True:
+            key = self._value()
+            self._next(u':')
+            if key == self._items_key and self._peek() == u'[':
+                self._pos += 1
+                for item in self._array():
+                    yield item
+            else:
+                self.document[key] = self._value()
+            if self._next(u',}') == u'}':
+                return
+
+    def _array(self):
+        if self._peek() == u']':
+            self._pos += 1
+            return
+        while True:
+            yield self._value()
+            if self._next(u',]') == u']':
+                return
+
+    def _fill(self):
+        if self._timed:
+            started = time.time()
+            chunk = self._read(self.chunk_size)
+            self.read_time += time.time() - started
+        else:
+            chunk = self._read(self.chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        """ Return the next non whitespace character without consuming it.
+        """
+        while True:
+            self._pos = _whitespace.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError('Unexpected end of json document')
+
+    def _next(self, expected):
+        char = self._peek()
+        if char not in expected:
+            raise ValueError('Expected one of {0!r} at {1!r}'.format(expected, self._buffer[self._pos:self._pos + 20]))
+        self._pos += 1
+        return char
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                if self._timed:
+                    started = time.time()
+                    value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                    self.decode_time += time.time() - started
+                else:
+                    value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if self._fill():
+                    continue
+                raise
+            # A number at the end of the buffer may continue in the next chunk
+            if (end == len(self._buffer) or self._buffer[end] in '.eE') and not self._eof and self._fill():
+                continue
+            self._pos = end
+            return value
+
+
+class APIError(Exception):
+    """ The management API answered with an error status.
+    """
+    def __init__(self, status, reason, url):
+        super(APIError, self).__init__('{0} {1}: {2}'.format(status, reason, url))
+        self.status = status
+        self.reason = reason
+
+
+Changeset = collections.namedtuple('Changeset', ['added', 'removed', 'changed'])
 
 
 class Rabbit(object):
 
     message_stat_keys = ['publish', 'confirm', 'return_unroutable', ]
 
-    def __init__(self, management_node, user, password, port, vhost=None):
-        _overview = overview(management_node, user, password, port)
+    def __init__(self, client, vhost=None, timeout=None, page_size=None, history_size=NODE_HISTORY,
+                 queue_history_size=RATE_SAMPLES, clock=time.time, timings=None, top=None, top_by='ready',
+                 topology_ttl=TOPOLOGY_TTL, discover=False, node_detail_ttl=NODE_DETAIL_TTL, queue_downsample=False):
+        self._client = client
+        self._timings = timings
+        # Time source of the history, a replay passes the time of the recording
+        self._clock = clock
+        # Spread api calls over the management listeners of the running nodes
+        self._discover = discover
+        self._history_size = history_size
+        # The history of all queues, the downsampled tier costs as much again and is only kept when asked for
+        self._queue_history = queue_history(queue_history_size, DOWNSAMPLE if queue_downsample else None)
         self._vhost = vhost or ''
-        self.version = _overview['rabbitmq_version']
-        self.cluster_name = _overview.get('cluster_name')
-        self.erlang_version = _overview['erlang_version']
-        self.messages = {
-            'total': {
-                'count': _overview['queue_totals']['messages'],
-                'rate': _overview['queue_totals']['messages_details']['rate']
-            },
-            'ready': {
-                'count': _overview['queue_totals']['messages_ready'],
-                'rate': _overview['queue_totals']['messages_ready_details']['rate']
-            },
-            'unacknowledged': {
-                'count': _overview['queue_totals']['messages_unacknowledged'],
-                'rate': _overview['queue_totals']['messages_unacknowledged_details']['rate']
-            },
-        }
-        self._objects = _overview['object_totals']
-        self._stats = _overview['message_stats']
+        self._timeout = timeout
+        # Only keep the top queues by a TOP_FIELDS field, they are fetched without paging
+        self.top = top
+        self.top_by = top_by
+        # The api answers pages larger than MAX_PAGE_SIZE with an error
+        self._page_size = None if top or not page_size else min(page_size, MAX_PAGE_SIZE)
+        self._window = (0, self._page_size or 0)
+        # Queue attribute to sort by (see queue_view.SORT_COLUMNS) and the queue Filter
+        self.sort = TOP_FIELDS[top_by][1] if top else None
+        self.sort_reverse = bool(top)
+        self.filter = Filter()
+        self._view = QueueView()
+        # Exchanges and bindings, only fetched while they are shown
+        self.topology = Topology(client, self._vhost, topology_ttl, clock)
+        # Status and memory breakdown of the selected node
+        self.node_detail = NodeDetail(client, node_detail_ttl, clock)
+        self.connections = ConnectionGroups(client, self._vhost, clock=clock)
+        self.channels = TopChannels(client, self._vhost, clock=clock)
+        # The Cached parts by the name of their section, only fetched while they are shown
+        self._cached = collections.OrderedDict([
+            ('exchanges', self.topology),
+            ('node detail', self.node_detail),
+            ('connections', self.connections),
+            ('channels', self.channels),
+        ])
+        self.errors = []
+        self.durations = {}
+        self._failed = {}
 
-        self._nodes = []
-        nodes = status(management_node, user, password, port, node_name=None)
-        for node in nodes:
-            self._nodes.append(Node(node))
+        self.version = NOT_AVAILABLE
+        self.cluster_name = None
+        self.erlang_version = NOT_AVAILABLE
+        self.messages = {}
+        self._objects = {}
+        self._stats = {}
+        # Message counts of the cluster to compute rates the server did not send
+        self._totals_history = RingBuffer(RATE_SAMPLES, 3)
 
+        self._nodes = []
+        self._node_index = {}
         self._queues = []
-        queues = list_queues(management_node, user, password, port, vhost=self._vhost)
-        for queue in queues:
-            self._queues.append(RabbitQueue(queue))
+        self._queue_index = {}
+        self.queue_offset = 0
+        self.queue_count = 0
+        self.changeset = Changeset([], [], [])
+        self._changesets = []
+        self._lock = threading.Lock()
+        self._queues_refreshing = threading.Lock()
+
+    def refresh(self, sections=SECTIONS):
+        """ Fetch the current state from the API and update the model in place.
+
+        Only the given sections are fetched, and the Cached parts (exchanges,
+        node detail, connections and channels) that are due. Sections that
+        could not be fetched keep their previous values and are listed in
+        `errors`, the seconds each fetch took are in `durations`. Returns the
+        Changeset of the queues.
+        """
+        started = time.time()
+        calls = {
+            'overview': (overview, (self._client,)),
+            'nodes': (status, (self._client,)),
+            'queues': (self._refresh_queues, ()),
+        }
+        sections = tuple(sections)
+        for key, cached in self._cached.items():
+            calls[key] = (cached.refresh, ())
+            if cached.due():
+                sections += (key,)
+        durations = {}
+        results = fetch_concurrently(dict((key, calls[key]) for key in sections), timeout=self._timeout,
+                                     durations=durations)
+        self.durations = durations
+        for key in sections:
+            self._failed[key] = results[key] is None
+
+        updated = time.time()
+        for key, update in (('overview', self._update_overview), ('nodes', self._update_nodes)):
+            if results.get(key) is None:
+                continue
+            # A section the model can not make sense of is unavailable, the other sections are still updated
+            try:
+                update(results[key])
+            except Exception:
+                _log.debug('Updating %s failed', key, exc_info=True)
+                self._failed[key] = True
+        if self._timings:
+            self._timings.add('model nodes', time.time() - updated)
+        self.errors = [key for key in SECTIONS + tuple(self._cached) if self._failed.get(key)]
+
+        with self._lock:
+            changesets, self._changesets = self._changesets, []
+        self.changeset = Changeset(
+            [queue for changeset in changesets for queue in changeset.added],
+            [queue for changeset in changesets for queue in changeset.removed],
+            [queue for changeset in changesets for queue in changeset.changed],
+        )
+        self._view.update(self.changeset)
+        if self._timings:
+            self._timings.add('refresh', time.time() - started)
+        return self.changeset
+
+    def cached_due(self):
+        """ True when a Cached part that is shown should be fetched.
+        """
+        return any(cached.due() for cached in self._cached.values())
+
+    def invalidate_cached(self):
+        for cached in self._cached.values():
+            cached.invalidate()
+
+    def set_window(self, offset, height):
+        """ Set the range of queues on screen, with paging only that range is fetched.
+        """
+        self._window = (offset, height)
+
+    def _refresh_queues(self):
+        """ Stream the queue listing into the model.
+
+        Runs in a worker thread that may outlive the refresh timeout, so its
+        Changeset is queued for the next refresh and a new queue refresh is
+        refused while the previous one is still running.
+        """
+        if not self._queues_refreshing.acquire(False):
+            raise RuntimeError('The previous queue refresh is still running')
+        try:
+            listing = {'offset': 0, 'count': None}
+            started = time.time()
+            queues_data = self._fetch_queues(listing)
+            if self._timings:
+                # Fetching and decoding happen while the listing is iterated, they are timed by the client
+                queues_data = TimedIterator(queues_data)
+            changeset = self._update_queues(queues_data)
+            if self._timings:
+                self._timings.add('model queues', time.time() - started - queues_data.elapsed)
+            self.queue_offset = listing['offset']
+            self.queue_count = len(self._queues) if listing['count'] is None else listing['count']
+            with self._lock:
+                self._changesets.append(changeset)
+            return changeset
+        finally:
+            self._queues_refreshing.release()
+
+    def _fetch_queues(self, listing):
+        """ Yield the queues to show as they are decoded.
+
+        Without a page size all queues are fetched. Otherwise only the pages
+        covering the window plus a screen of queues on either side are
+        fetched; listing is updated with the position of the first of those
+        queues (offset) and the length of the full listing (count). The api
+        only filters by the first name term, with a filter it can not apply
+        the whole listing is fetched at once and filtered here. In top mode
+        only the top queues are fetched.
+        """
+        if self.top:
+            for queue in self._fetch_top():
+                yield queue
+            return
+
+        # The rows and their count follow from the queues that match a filter the api can not apply
+        if not self._page_size or self.filter.local:
+            for queue in list_queues(self._client, self._vhost, columns=QUEUE_COLUMNS, stream=True):
+                yield queue
+            return
+
+        offset, height = self._window
+        page_count = max((self.queue_count + self._page_size - 1) // self._page_size, 1)
+        first_page = min(max(offset - height, 0) // self._page_size + 1, page_count)
+        last_page = min((offset + 2 * height) // self._page_size + 1, page_count)
+
+        listing['offset'] = (first_page - 1) * self._page_size
+        for page in range(first_page, last_page + 1):
+            result = list_queues(self._client, self._vhost, columns=QUEUE_COLUMNS, page=page,
+                                 page_size=self._page_size, sort=API_SORT_FIELDS.get(self.sort),
+                                 sort_reverse=self.sort_reverse, name_regex=self.filter.name_pattern, stream=True)
+            for queue in result:
+                yield queue
+            if isinstance(result.document, list):
+                # The server does not support paging and returned everything
+                listing['offset'] = 0
+                return
+            listing['count'] = result.document['filtered_count']
+            if page >= result.document['page_count']:
+                break
 
-        self.active_queues = False
+    def _fetch_top(self):
+        """ Return the top queues by the top_by field, largest first.
+        """
+        return fetch_top(list_queues, self._client, self._vhost, QUEUE_COLUMNS, TOP_FIELDS[self.top_by][0], self.top)
+
+    def _update_overview(self, _overview):
+        self.version = _overview.get('rabbitmq_version', NOT_AVAILABLE)
+        self.cluster_name = _overview.get('cluster_name')
+        self.erlang_version = _overview.get('erlang_version', NOT_AVAILABLE)
+        if 'queue_totals' in _overview:
+            totals = _overview['queue_totals']
+            counts = [totals.get(key) for key in ('messages', 'messages_ready', 'messages_unacknowledged')]
+            if None not in counts:
+                self._totals_history.append(self._clock(), *counts)
+            self.messages = {
+                'total': {
+                    'count': counts[0],
+                    'rate': _rate(totals, 'messages_details', self._totals_history, 0)
+                },
+                'ready': {
+                    'count': counts[1],
+                    'rate': _rate(totals, 'messages_ready_details', self._totals_history, 1)
+                },
+                'unacknowledged': {
+                    'count': counts[2],
+                    'rate': _rate(totals, 'messages_unacknowledged_details', self._totals_history, 2)
+                },
+            }
+        self._objects = _overview.get('object_totals', {})
+        self._stats = _overview.get('message_stats', {})
+
+    def _update_nodes(self, nodes_data):
+        nodes = []
+        index = {}
+        timestamp = self._clock()
+        for node_data in nodes_data:
+            node = self._node_index.get(node_data['name'])
+            if node is None:
+                node = Node(node_data, self._history_size)
+            else:
+                node.update(node_data)
+            values = (node.mem_used, node.disk_free, node.fd, node.sockets_used, node.proc_used)
+            if NOT_AVAILABLE not in values:
+                node.history.append(timestamp, *values)
+            index[node.name] = node
+            nodes.append(node)
+        self._nodes = nodes
+        self._node_index = index
+        if self._discover:
+            self._client.hosts.set_nodes([node.name for node in nodes if node.running])
+
+    def _update_queues(self, queues_data):
+        """ Diff the queue listing against the known queues by (vhost, name).
+        """
+        added = []
+        changed = []
+        queues = []
+        index = {}
+        timestamp = self._clock()
+        for queue_data in queues_data:
+            key = (queue_data.get('vhost'), queue_data.get('name'))
+            queue = self._queue_index.get(key)
+            if queue is None:
+                queue = RabbitQueue(queue_data, timestamp, self._queue_history)
+                added.append(queue)
+            elif queue.update(queue_data, timestamp):
+                changed.append(queue)
+            index[key] = queue
+            queues.append(queue)
+
+        removed = [queue for key, queue in self._queue_index.items() if key not in index]
+        for queue in removed:
+            queue.release()
+        self._queues = queues
+        self._queue_index = index
+        return Changeset(added, removed, changed)
+
+    @property
+    def vhost(self):
+        return self._vhost
 
     @property
     def nodes(self):
         return self._nodes
 
+    @property
+    def hosts(self):
+        """ The HostPool api calls are spread over, None when the nodes are not discovered.
+        """
+        return self._client.hosts if self._discover else None
+
     @property
     def queues(self):
-        if self.active_queues:
-            return [queue for queue in self._queues if queue.state != 'idle']
+        """ The queues that match the filter, in sort order.
+        """
+        if self._page_size and not self.filter.local:
+            # The api sorted and filtered the window by name already
+            return self.filter.apply(self._queues) if self.filter else self._queues
+        return self._view.queues(self._queues, self.sort, self.sort_reverse, self.filter)
+
+    @property
+    def queue_columns(self):
+        """ The latest value of the RabbitQueue.metric_columns by name, arrays indexed by the slot of a queue.
+        """
+        return dict(zip(RabbitQueue.metric_columns, self._queue_history.current))
+
+    @property
+    def all_queues(self):
+        """ The queues as listed by the api, without the filter and sort order of the ui.
+        """
         return self._queues
 
+    @property
+    def active_queues(self):
+        return self.filter.active
+
+    @active_queues.setter
+    def active_queues(self, active):
+        self.filter = Filter(self.filter.text, active)
+
+    @property
+    def queues_complete(self):
+        """ False when only a window of the queue listing was fetched.
+        """
+        return self.queue_offset == 0 and self.queue_count == len(self._queues)
+
+    @property
+    def window_loaded(self):
+        """ True when the queues in the window set by set_window have been fetched.
+        """
+        offset, height = self._window
+        end = min(offset + height, self.queue_count)
+        return self.queues_complete or self.queue_offset <= offset and end <= self.queue_offset + len(self._queues)
+
+    def queue(self, vhost, name):
+        return self._queue_index.get((vhost, name))
+
     @property
     def objects(self):
         return self._objects
@@ -123,57 +966,412 @@ class Rabbit(object):
         }
         details = {}
         for key in keys:
-            details[keys[key]] = self._stats.get(key, {'rate': 'N/A'})['rate']
+            details[keys[key]] = _rate(self._stats, key)
         return details
 
+
+Exchange = collections.namedtuple('Exchange', ['vhost', 'name', 'type', 'rate_in', 'rate_out', 'routes'])
+
+
+class Cached(object):
+    """ Data that is expensive to fetch and only needed while it is shown.
+
+    It is only fetched while `wanted`, and then cached for `ttl` seconds:
+    Rabbit.refresh adds a refresh() to the next refresh when due() says
+    the cached copy is missing or expired. invalidate() makes the next
+    refresh fetch it again. Subclasses implement _fetch.
+    """
+
+    def __init__(self, client, ttl, clock=time.time):
+        self._client = client
+        self._clock = clock
+        self.ttl = ttl
+        self.wanted = False
+        self.fetched_at = None
+        # Counts the invalidations, a fetch that started before one does not count as fresh
+        self._generation = 0
+        self._refreshing = threading.Lock()
+
+    def due(self):
+        return self.wanted and (self.fetched_at is None or self._clock() - self.fetched_at >= self.ttl)
+
+    def invalidate(self):
+        self._generation += 1
+        self.fetched_at = None
+
+    @property
+    def age(self):
+        """ Seconds since the data was fetched, None before that.
+        """
+        return None if self.fetched_at is None else self._clock() - self.fetched_at
+
+    def refresh(self):
+        """ Fetch the data, runs in a worker thread like Rabbit._refresh_queues.
+        """
+        if not self._refreshing.acquire(False):
+            raise RuntimeError('The previous refresh of %s is still running' % type(self).__name__)
+        try:
+            fetched_at, generation = self._clock(), self._generation
+            result = self._fetch()
+            if generation == self._generation:
+                self.fetched_at = fetched_at
+            return result
+        finally:
+            self._refreshing.release()
+
+    def _fetch(self):
+        raise NotImplementedError
+
+
+class Topology(Cached):
+    """ The exchanges of a vhost with their publish rates and where they route to.
+
+    Exchanges and bindings rarely change while their listings can be long,
+    every queue is bound to the default exchange, so they are Cached.
+    """
+
+    def __init__(self, client, vhost='', ttl=TOPOLOGY_TTL, clock=time.time):
+        super(Topology, self).__init__(client, ttl, clock)
+        self._vhost = vhost
+        # Exchange tuples sorted by vhost and name, routes are the queues and exchanges bound to them
+        self.exchanges = []
+
+    def _fetch(self):
+        exchanges_data = list_exchanges(self._client, self._vhost, columns=EXCHANGE_COLUMNS)
+        routes = collections.defaultdict(set)
+        for binding in list_bindings(self._client, self._vhost, columns=BINDING_COLUMNS, stream=True):
+            if not binding.get('source'):
+                # The default exchange routes to every queue by its name
+                continue
+            destination = binding['destination']
+            if binding.get('destination_type') == 'exchange':
+                destination = 'exchange:' + destination
+            routes[binding['vhost'], binding['source']].add(destination)
+
+        exchanges = []
+        for vhost in sorted(exchanges_data):
+            for name, exchange_data in sorted(exchanges_data[vhost].items()):
+                stats = exchange_data.get('message_stats') or {}
+                exchanges.append(Exchange(vhost, name, exchange_data.get('type'),
+                                          _rate(stats, 'publish_in_details'), _rate(stats, 'publish_out_details'),
+                                          sorted(routes.get((vhost, name), ()))))
+        self.exchanges = exchanges
+        return exchanges
+
+
+class NodeDetail(Cached):
+    """ The status of the selected node with its memory breakdown.
+
+    The breakdown is costly for the node to compute, so it is Cached for a
+    short while and only fetched while a node is selected, from the
+    management listener of that node when it is known.
+    """
+
+    def __init__(self, client, ttl=NODE_DETAIL_TTL, clock=time.time):
+        super(NodeDetail, self).__init__(client, ttl, clock)
+        self.node_name = None
+        # Bytes by memory category, largest first
+        self.memory = []
+        self.status = {}
+
+    def select(self, node_name):
+        """ Show the detail of the node, or of no node with None.
+        """
+        if node_name != self.node_name:
+            self.node_name = node_name
+            self.memory = []
+            self.status = {}
+            self.invalidate()
+        self.wanted = node_name is not None
+
+    def _fetch(self):
+        node_name = self.node_name
+        hosts = getattr(self._client, 'hosts', None)
+        node_status = status(self._client, node_name, hosts.host_of(node_name) if hosts else None)
+        if node_name != self.node_name:
+            # Another node was selected meanwhile, it is fetched by the next refresh
+            return {}
+        self.memory = _memory_breakdown(node_status.get('memory'))
+        self.status = node_status
+        return node_status
+
+
+ConnectionGroup = collections.namedtuple('ConnectionGroup', ['key', 'connections', 'channels', 'recv_rate',
+                                                             'send_rate', 'others'])
+
+
+class ConnectionGroups(Cached):
+    """ The connections aggregated per peer host and per user.
+
+    A connection storm can mean tens of thousands of connections, so they
+    are streamed a page at a time with only the columns that are aggregated
+    and are never kept themselves: memory is bound by the number of hosts
+    and users, and at most MAX_CONNECTION_PAGES pages are read, `partial`
+    tells when there were more.
+    """
+
+    def __init__(self, client, vhost='', ttl=ACTIVITY_TTL, clock=time.time):
+        super(ConnectionGroups, self).__init__(client, ttl, clock)
+        self._vhost = vhost
+        # ConnectionGroup tuples by peer_host and by user, most connections first. others counts the users of a
+        # host or the hosts of a user
+        self.groups = {'peer_host': [], 'user': []}
+        # The grouping shown, both are aggregated anyway
+        self.grouping = 'peer_host'
+        self.count = 0
+        self.partial = False
+
+    def _fetch(self):
+        totals = {'peer_host': {}, 'user': {}}
+        count = 0
+        page = 1
+        while True:
+            result = list_connections(self._client, self._vhost, columns=CONNECTION_COLUMNS, page=page,
+                                      page_size=MAX_PAGE_SIZE, stream=True)
+            for connection in result:
+                count += 1
+                host, user = connection.get('peer_host') or NOT_AVAILABLE, connection.get('user') or NOT_AVAILABLE
+                _add_connection(totals['peer_host'], host, user, connection)
+                _add_connection(totals['user'], user, host, connection)
+            # A list instead of a page means the server returned all connections at once
+            document = getattr(result, 'document', None)
+            if not isinstance(document, dict) or page >= document.get('page_count', page):
+                partial = False
+                break
+            if page >= MAX_CONNECTION_PAGES:
+                partial = True
+                break
+            page += 1
+
+        self.groups = dict(
+            (grouping, sorted((ConnectionGroup(key, total[0], total[1], total[2], total[3], len(total[4]))
+                               for key, total in groups.items()), key=lambda group: (-group.connections, group.key)))
+            for grouping, groups in totals.items())
+        self.count = count
+        self.partial = partial
+        return self.groups
+
+
+def _add_connection(groups, key, other, connection):
+    total = groups.get(key)
+    if total is None:
+        total = groups[key] = [0, 0, 0.0, 0.0, set()]
+    total[0] += 1
+    total[1] += max(_field(connection, 'channels'), 0)
+    total[2] += max(_field(connection, 'recv_oct_details.rate'), 0)
+    total[3] += max(_field(connection, 'send_oct_details.rate'), 0)
+    total[4].add(other)
+
+
+Channel = collections.namedtuple('Channel', ['name', 'user', 'vhost', 'unacked', 'prefetch', 'consumers',
+                                             'publish_rate', 'deliver_rate', 'ack_rate'])
+
+
+class TopChannels(Cached):
+    """ The channels with the largest value of one of the CHANNEL_ORDERS.
+
+    Only the top `count` channels are asked for, sorted by the api (3.6+),
+    with the columns that are shown, however many channels there are.
+    """
+
+    def __init__(self, client, vhost='', ttl=ACTIVITY_TTL, clock=time.time, count=TOP_CHANNELS):
+        super(TopChannels, self).__init__(client, ttl, clock)
+        self._vhost = vhost
+        self._count = count
+        self.order = list(CHANNEL_ORDERS)[0]
+        # Channel tuples in order
+        self.channels = []
+
+    def set_order(self, order):
+        self.order = order
+        self.invalidate()
+
+    def _fetch(self):
+        channels = []
+        for item in fetch_top(list_channels, self._client, self._vhost, CHANNEL_COLUMNS, CHANNEL_ORDERS[self.order],
+                              self._count):
+            stats = item.get('message_stats') or {}
+            channels.append(Channel(
+                item.get('name'), item.get('user'), item.get('vhost'),
+                item.get('messages_unacknowledged', NOT_AVAILABLE), item.get('prefetch_count', NOT_AVAILABLE),
+                item.get('consumer_count', NOT_AVAILABLE), _rate(stats, 'publish_details'),
+                _rate(stats, 'deliver_get_details'), _rate(stats, 'ack_details')))
+        self.channels = channels
+        return channels
+
+
+def _memory_breakdown(memory):
+    """ Return (category, bytes) of the memory of a node, largest first.
+
+    The total is left out, since 3.7 it holds the totals of several
+    strategies (erlang, rss, allocated) instead of one number.
+    """
+    if not isinstance(memory, dict):
+        return []
+    return sorted(((key, value) for key, value in memory.items()
+                   if key not in ('total', 'strategy') and isinstance(value, (int, long))),
+                  key=lambda item: (-item[1], item[0]))
+
+
 class Node(object):
-    def __init__(self, node_data):
+
+    # Columns of the node history
+    history_columns = ('mem_used', 'disk_free', 'fd', 'sockets_used', 'proc_used')
+
+    def __init__(self, node_data, history_size=NODE_HISTORY):
         self.name = node_data['name']
-        self.type = node_data['type']
-        self.running = node_data['running']
-
-        self.pid = node_data['os_pid']
-        self.fd = node_data['fd_used']
-        self.fd_total = node_data['fd_total']
-        self.sockets_used = node_data['sockets_used']
-        self.sockets_total = node_data['sockets_total']
-        self.mem_used = node_data['mem_used']
-        self.mem_limit = node_data['mem_limit']
-        self.mem_alarm = node_data['mem_alarm']
-        self.disk_free_limit = node_data['disk_free_limit']
-        self.disk_free = node_data['disk_free']
-        self.disk_free_alarm = node_data['disk_free_alarm']
-        self.proc_used = node_data['proc_used']
-        self.proc_totoal = node_data['proc_total']
-        self.uptime = datetime.timedelta(milliseconds=node_data['uptime'])
+        self.history = MetricHistory(history_size, len(self.history_columns), DOWNSAMPLE)
+        self.update(node_data)
+
+    def update(self, node_data):
+        """ Update the node in place, a node that is not running is listed without its stats.
+        """
+        self.type = node_data.get('type', NOT_AVAILABLE)
+        self.running = node_data.get('running', False)
+
+        self.pid = node_data.get('os_pid', NOT_AVAILABLE)
+        self.fd = node_data.get('fd_used', NOT_AVAILABLE)
+        self.fd_total = node_data.get('fd_total', NOT_AVAILABLE)
+        self.sockets_used = node_data.get('sockets_used', NOT_AVAILABLE)
+        self.sockets_total = node_data.get('sockets_total', NOT_AVAILABLE)
+        self.mem_used = node_data.get('mem_used', NOT_AVAILABLE)
+        self.mem_limit = node_data.get('mem_limit', NOT_AVAILABLE)
+        self.mem_alarm = node_data.get('mem_alarm', False)
+        self.disk_free_limit = node_data.get('disk_free_limit', NOT_AVAILABLE)
+        self.disk_free = node_data.get('disk_free', NOT_AVAILABLE)
+        self.disk_free_alarm = node_data.get('disk_free_alarm', False)
+        self.proc_used = node_data.get('proc_used', NOT_AVAILABLE)
+        self.proc_totoal = node_data.get('proc_total', NOT_AVAILABLE)
+        self.uptime = datetime.timedelta(milliseconds=node_data['uptime']) if 'uptime' in node_data else NOT_AVAILABLE
 
 
 class RabbitQueue(object):
-    def __init__(self, queue_data):
+    """ A single queue.
+
+    Queues are kept for every queue in the cluster, so instances use
+    __slots__ instead of a __dict__, store each value once and share the
+    strings that repeat across queues (vhost, state, policy).
+
+    The message counts of the last refreshes are kept in a slot of the
+    ColumnarHistory of all queues, rates the server does not send (reduced
+    stats collection) are computed from it.
+    """
+
+    __slots__ = ('name', 'vhost', 'policy', 'exclusive', 'params', 'state', 'total', 'total_rate',
+                 'ready', 'ready_rate', 'unacked', 'unacked_rate', '_history', 'slot')
+
+    _fields = ('policy', 'exclusive', 'params', 'state', 'total', 'total_rate', 'ready', 'ready_rate',
+               'unacked', 'unacked_rate')
+
+    # Columns of the queue history, the total is their sum
+    history_columns = ('ready', 'unacked')
+
+    # Attributes of which the history keeps the latest value, as numbers or MISSING, to evaluate queues in batches
+    metric_columns = ('ready', 'unacked', 'total', 'total_rate', 'ready_rate', 'unacked_rate')
+
+    def __init__(self, queue_data, timestamp=None, history=None):
         self.name = queue_data.get('name')
-        self.vhost = queue_data.get('vhost')
-        self.state = queue_data.get('state')
-        self.policy = ''
-        self.exclusive = ''
-        self.params = ''
-        self.state = ''
+        self.vhost = _shared(queue_data.get('vhost'))
+        self._history = _queue_history if history is None else history
+        # The slot of the queue in its history, None once the queue was released
+        self.slot = self._history.allocate()
+        self.update(queue_data, timestamp)
+
+    @property
+    def history(self):
+        """ The history of the history_columns, empty once the queue was released.
+        """
+        return _no_history if self.slot is None else self._history.series(self.slot)
+
+    def release(self):
+        """ Give the history slot of a queue that no longer exists back for reuse.
+        """
+        if self.slot is not None:
+            self._history.release(self.slot)
+            self.slot = None
+
+    @property
+    def key(self):
+        return self.vhost, self.name
+
+    @property
+    def messages(self):
+        return {
+            'total': {'count': self.total, 'rate': self.total_rate},
+            'ready': {'count': self.ready, 'rate': self.ready_rate},
+            'unacknowledged': {'count': self.unacked, 'rate': self.unacked_rate},
+        }
+
+    def update(self, queue_data, timestamp=None):
+        """ Update the queue in place, return True when any of its values changed.
+        """
+        old_values = [getattr(self, field, None) for field in self._fields]
+        self.policy = _shared(queue_data.get('policy') or '')
+        self.exclusive = 'yes' if queue_data.get('exclusive') else ''
+        self.params = _shared(','.join(sorted(queue_data.get('arguments') or {})))
+        self.state = _shared(queue_data.get('state'))
         self.total = queue_data.get('messages')
-        self.total_rate = queue_data.get('messages_details', {'rate': 'N/A'})['rate']
         self.ready = queue_data.get('messages_ready')
-        self.ready_rate = queue_data.get('messages_ready_details', {'rate': 'N/A'})['rate']
         self.unacked = queue_data.get('messages_unacknowledged')
-        self.unacked_rate = queue_data.get('messages_unacknowledged_details', {'rate': 'N/A'})['rate']
-        self.messages = {
-            'total': {
-                'count': queue_data.get('messages'),
-                'rate': queue_data.get('messages_details', {'rate': 'N/A'})['rate']
-            },
-            'ready': {
-                'count': queue_data.get('messages_ready'),
-                'rate': queue_data.get('messages_ready_details', {'rate': 'N/A'})['rate']
-            },
-            'unacknowledged': {
-                'count': queue_data.get('messages_unacknowledged'),
-                'rate': queue_data.get('messages_unacknowledged_details', {'rate': 'N/A'})['rate']
-            },
-        }
\ No newline at end of file
+        if self.slot is not None and None not in (self.ready, self.unacked):
+            self._history.append(self.slot, timestamp or time.time(), self.ready, self.unacked)
+        history = self.history
+        self.ready_rate = _rate(queue_data, 'messages_ready_details', history, 0)
+        self.unacked_rate = _rate(queue_data, 'messages_unacknowledged_details', history, 1)
+        self.total_rate = _rate(queue_data, 'messages_details')
+        if self.total_rate == NOT_AVAILABLE and NOT_AVAILABLE not in (self.ready_rate, self.unacked_rate):
+            self.total_rate = round(self.ready_rate + self.unacked_rate, 1)
+        if [getattr(self, field) for field in self._fields] == old_values:
+            return False
+        if self.slot is not None:
+            self._history.set_current(self.slot, *[_metric(getattr(self, column)) for column in self.metric_columns])
+        return True
+
+
+def queue_history(size=RATE_SAMPLES, factor=None):
+    """ Return a ColumnarHistory for RabbitQueues, of their history_columns and the latest metric_columns.
+    """
+    return ColumnarHistory(size, len(RabbitQueue.history_columns), factor, len(RabbitQueue.metric_columns))
+
+
+# History of the queues created without one of their own, e.g. in the benchmarks
+_queue_history = queue_history()
+_no_history = MetricHistory(1, len(RabbitQueue.history_columns))
+
+_shared_strings = {}
+
+
+def _field(data, field):
+    """ Return the number at a dotted api field of an item, -1 when it is missing
+    """
+    for key in field.split('.'):
+        if not isinstance(data, dict) or key not in data:
+            return -1
+        data = data[key]
+    return data if isinstance(data, (int, long, float)) else -1
+
+
+def _endpoint(path):
+    """ The first segment of an api path, e.g. queues for queues/vhost/?columns=name
+    """
+    return path.split('?')[0].split('/')[0]
+
+
+def _shared(value):
+    """ Return a shared instance of a string that repeats across many objects.
+    """
+    return _shared_strings.setdefault(value, value)
+
+
+def _metric(value):
+    return value if isinstance(value, (int, long, float)) else MISSING
+
+
+def _rate(data, key, history=None, column=0):
+    """ Return the rate the server sent, or else the rate computed from the history.
+    """
+    details = data.get(key)
+    if details and 'rate' in details:
+        return details['rate']
+    rate = history.rate(column) if history is not None else None
+    return round(rate, 1) if rate is not None else NOT_AVAILABLE
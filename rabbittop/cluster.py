@@ -0,0 +1,143 @@
+""" Monitored clusters
+"""
+import ConfigParser
+import functools
+import os
+import time
+
+from rabbittop import _rabbitmq, recording, rules
+from rabbittop.timing import Timings
+from rabbittop.poller import MAX_INTERVAL, MIN_INTERVAL, Poller
+
+
+class Cluster(object):
+    """ A RabbitMQ cluster with its own client, model and poller.
+
+    Every cluster is polled by its own thread with its own timeouts, so a
+    slow cluster does not hold up the others. When a recording Player is
+    given it takes the place of the client. With `timings` the stages of
+    every refresh are timed in a Timings. The queues are evaluated against
+    the Rules after every refresh, changes are passed to the alert hook.
+    """
+
+    def __init__(self, name, host, user, password, port, vhost=None, ssl=False, timeout=10, interval=3,
+                 page_size=0, history=_rabbitmq.NODE_HISTORY, queue_history=_rabbitmq.RATE_SAMPLES, player=None, timings=False, top=None,
+                 top_by='ready', min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 topology_ttl=_rabbitmq.TOPOLOGY_TTL, spread=False, node_ttl=_rabbitmq.NODE_DETAIL_TTL, rule_set=None,
+                 alert_command=None, queue_downsample=False):
+        self.name = name
+        self.player = player
+        self.timings = Timings() if timings else None
+        if player:
+            self.client = player
+        else:
+            self.client = _rabbitmq.Client(host, user, password, port, use_ssl=ssl, timeout=timeout)
+            self.client.timings = self.timings
+        self.rabbit = _rabbitmq.Rabbit(self.client, vhost=vhost, timeout=timeout, page_size=page_size,
+                                       history_size=history, queue_history_size=queue_history,
+                                       clock=player.time if player else time.time, timings=self.timings,
+                                       top=top, top_by=top_by, topology_ttl=topology_ttl,
+                                       discover=spread and not player, node_detail_ttl=node_ttl,
+                                       queue_downsample=queue_downsample)
+        self.poller = Poller(self.rabbit, interval, prepare=player.sync if player else None, floor=min_interval,
+                             ceiling=max_interval)
+        self.alerts = rules.Alerts(rule_set or rules.Rules(),
+                                   rules.command_hook(alert_command, name) if alert_command else None)
+        self.poller.add_listener(functools.partial(self.alerts.update, self.rabbit))
+
+    def start(self):
+        self.poller.start()
+
+    def stop(self):
+        self.poller.stop()
+        self.client.close()
+
+    @property
+    def alarms(self):
+        """ Names of the nodes with a memory or disk alarm
+        """
+        return [node.name for node in self.rabbit.nodes if node.mem_alarm or node.disk_free_alarm]
+
+
+def from_args(args):
+    """ Create the clusters given on the command line and in the config file.
+
+    Each section of the config file is a cluster named after the section,
+    with the same options as the command line (host, port, user, password,
+    vhost, ssl, timeout, interval, page_size, history, queue_history, queue_downsample,
+    timings, top, top_by, min_interval, max_interval, topology_ttl, spread, node_ttl, alert_command).
+    Missing options default to the command line values. With a replay file the only cluster is the recording.
+    All clusters share the Rules of the rules file.
+    """
+    defaults = {
+        'port': args.port,
+        'user': args.user,
+        'password': args.password,
+        'vhost': args.vhost,
+        'ssl': args.ssl,
+        'timeout': args.timeout,
+        'interval': args.interval,
+        'page_size': args.page_size,
+        'history': args.history,
+        'queue_history': args.queue_history,
+        'queue_downsample': args.queue_downsample,
+        'timings': args.timings,
+        'top': args.top,
+        'top_by': args.by,
+        'min_interval': args.min_interval,
+        'max_interval': args.max_interval,
+        'topology_ttl': args.topology_ttl,
+        'spread': args.spread,
+        'node_ttl': args.node_ttl,
+        'alert_command': args.alert_command,
+        'rule_set': rules.load(args.rules) if args.rules else rules.Rules(),
+    }
+    if args.replay:
+        # The recording holds a single cluster, already limited to its vhost and without paging
+        defaults.update(vhost=None, page_size=0)
+        player = recording.Player(args.replay, speed=args.speed)
+        return [Cluster(os.path.basename(args.replay), None, player=player, **defaults)]
+    clusters = [Cluster(host, host, **defaults) for host in args.host]
+    if args.config:
+        clusters.extend(load(args.config, defaults))
+    return clusters
+
+
+def load(path, defaults):
+    """ Read the clusters from an ini style config file.
+    """
+    parser = ConfigParser.RawConfigParser()
+    with open(path) as config_file:
+        parser.readfp(config_file)
+
+    clusters = []
+    for name in parser.sections():
+        options = dict(defaults)
+        options.update(parser.items(name))
+        clusters.append(Cluster(
+            name,
+            options['host'],
+            options['user'],
+            options['password'],
+            options['port'],
+            vhost=options['vhost'] or None,
+            ssl=parser.getboolean(name, 'ssl') if parser.has_option(name, 'ssl') else options['ssl'],
+            timeout=float(options['timeout']),
+            interval=float(options['interval']),
+            page_size=int(options['page_size']),
+            history=int(options['history']),
+            queue_history=int(options['queue_history']),
+            queue_downsample=parser.getboolean(name, 'queue_downsample') if parser.has_option(name, 'queue_downsample')
+            else options['queue_downsample'],
+            timings=parser.getboolean(name, 'timings') if parser.has_option(name, 'timings') else options['timings'],
+            top=int(options['top']) if options['top'] else None,
+            top_by=options['top_by'],
+            min_interval=float(options['min_interval']),
+            max_interval=float(options['max_interval']),
+            topology_ttl=float(options['topology_ttl']),
+            spread=parser.getboolean(name, 'spread') if parser.has_option(name, 'spread') else options['spread'],
+            node_ttl=float(options['node_ttl']),
+            rule_set=options['rule_set'],
+            alert_command=options['alert_command'] or None,
+        ))
+    return clusters
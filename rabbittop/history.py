@@ -0,0 +1,271 @@
+""" Sample history
+"""
+import array
+import itertools
+
+
+class RingBuffer(object):
+    """ The last `size` samples of one or more values, with their timestamps.
+
+    Samples are stored interleaved (timestamp, value, ...) in one array of
+    doubles, so a buffer is a single small object even when there is one
+    for every queue. The oldest sample is overwritten when the buffer is full.
+    """
+
+    __slots__ = ('_data', '_width', '_size', '_next', '_count')
+
+    def __init__(self, size, columns=1):
+        self._width = columns + 1
+        self._size = size
+        self._data = array.array('d', [0.0]) * (size * self._width)
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, *values):
+        offset = self._next * self._width
+        self._data[offset] = timestamp
+        for column, value in enumerate(values):
+            self._data[offset + 1 + column] = value
+        self._next = (self._next + 1) % self._size
+        self._count = min(self._count + 1, self._size)
+
+    def samples(self, column=0):
+        """ Return the (timestamp, value) samples of a column, oldest first.
+        """
+        return [(self._data[offset], self._data[offset + 1 + column])
+                for offset in (self._offset(age) for age in range(self._count - 1, -1, -1))]
+
+    def last(self, column=0):
+        """ Return the newest value of a column, None when empty.
+        """
+        return self._data[self._offset(0) + 1 + column] if self._count else None
+
+    def rate(self, column=0, samples=None):
+        """ Change per second of a column over the newest `samples` samples.
+
+        Over two samples this is the current rate, over more it is their
+        moving average; by default the whole buffer is used. Returns None
+        until there are two samples.
+        """
+        count = self._count if samples is None else min(samples, self._count)
+        if count < 2:
+            return None
+        newest = self._offset(0)
+        oldest = self._offset(count - 1)
+        elapsed = self._data[newest] - self._data[oldest]
+        if elapsed <= 0:
+            return None
+        return (self._data[newest + 1 + column] - self._data[oldest + 1 + column]) / elapsed
+
+    def _offset(self, age):
+        """ Position in the array of the sample `age` samples before the newest.
+        """
+        return ((self._next - 1 - age) % self._size) * self._width
+
+
+class MetricHistory(object):
+    """ History of one or more metrics at two resolutions.
+
+    The newest `size` samples are kept as they are. Every `factor` samples
+    are also averaged into a second buffer of `size` points, which reaches
+    `factor` times further back at a lower resolution. Memory is fixed at
+    two ring buffers whatever the retention.
+    """
+
+    __slots__ = ('recent', 'older', '_factor', '_sums', '_pending')
+
+    def __init__(self, size, columns=1, factor=10):
+        self.recent = RingBuffer(size, columns)
+        self.older = RingBuffer(size, columns)
+        self._factor = factor
+        self._sums = array.array('d', [0.0]) * (columns + 1)
+        self._pending = 0
+
+    def __len__(self):
+        return len(self.recent)
+
+    def append(self, timestamp, *values):
+        self.recent.append(timestamp, *values)
+        self._sums[0] += timestamp
+        for column, value in enumerate(values):
+            self._sums[column + 1] += value
+        self._pending += 1
+        if self._pending == self._factor:
+            self.older.append(*[total / self._factor for total in self._sums])
+            for index in range(len(self._sums)):
+                self._sums[index] = 0.0
+            self._pending = 0
+
+    def last(self, column=0):
+        return self.recent.last(column)
+
+    def rate(self, column=0, samples=None):
+        return self.recent.rate(column, samples)
+
+    def values(self, column=0):
+        """ Return the values of a column, oldest first.
+
+        Downsampled points from before the oldest recent sample come first.
+        """
+        recent = self.recent.samples(column)
+        start = recent[0][0] if recent else None
+        older = [value for timestamp, value in self.older.samples(column) if start is None or timestamp < start]
+        return older + [value for _, value in recent]
+
+
+class ColumnarHistory(object):
+    """ The recent samples of a few counters of many series, e.g. every queue.
+
+    Every series owns a slot of `size` samples in arrays shared by all of
+    them, one array per column, so a series costs its samples and nothing
+    else: there is no object per series. Counts are stored as unsigned
+    32 bit integers. With `factor` every `factor` samples of a slot are also
+    averaged into a second ColumnarHistory that reaches further back.
+    Slots of removed series are reused.
+
+    With `current` the latest value of that many more columns is kept per
+    slot, as doubles without a history, so a batch of series can be
+    evaluated from arrays instead of from objects.
+    """
+
+    MAX_VALUE = 2 ** 32 - 1
+
+    def __init__(self, size, columns=1, factor=None, current=0):
+        self._size = size
+        self._columns = columns
+        self._times = array.array('d')
+        self._values = [array.array('I') for _ in range(columns)]
+        # The latest value of the current columns, by slot
+        self.current = [array.array('d') for _ in range(current)]
+        self._next = array.array('H')
+        self._count = array.array('H')
+        self._free = []
+        self.older = ColumnarHistory(size, columns) if factor else None
+        self._factor = factor
+        # Sums of the timestamps and the values not yet averaged, per slot
+        self._sums = array.array('d')
+        self._pending = array.array('H')
+
+    def allocate(self):
+        """ Return a free slot for a new series.
+        """
+        return self._free.pop() if self._free else self._grow()
+
+    def release(self, slot):
+        self._clear(slot)
+        self._free.append(slot)
+
+    def _grow(self):
+        slot = len(self._next)
+        self._times.extend(itertools.repeat(0.0, self._size))
+        for values in self._values:
+            values.extend(itertools.repeat(0, self._size))
+        self._next.append(0)
+        self._count.append(0)
+        for values in self.current:
+            values.append(0.0)
+        if self.older is not None:
+            # The older samples of a slot are in the same slot of the older history
+            self.older._grow()
+            self._sums.extend(itertools.repeat(0.0, self._columns + 1))
+            self._pending.append(0)
+        return slot
+
+    def _clear(self, slot):
+        self._next[slot] = self._count[slot] = 0
+        if self.older is not None:
+            self.older._clear(slot)
+            self._pending[slot] = 0
+            for index in range(slot * (self._columns + 1), (slot + 1) * (self._columns + 1)):
+                self._sums[index] = 0.0
+
+    def append(self, slot, timestamp, *values):
+        position = self._next[slot]
+        offset = slot * self._size + position
+        self._times[offset] = timestamp
+        for column, value in enumerate(values):
+            self._values[column][offset] = min(max(int(value), 0), self.MAX_VALUE)
+        self._next[slot] = (position + 1) % self._size
+        self._count[slot] = min(self._count[slot] + 1, self._size)
+        if self.older is not None:
+            self._downsample(slot, timestamp, values)
+
+    def set_current(self, slot, *values):
+        for column, value in zip(self.current, values):
+            column[slot] = value
+
+    def _downsample(self, slot, timestamp, values):
+        first = slot * (self._columns + 1)
+        self._sums[first] += timestamp
+        for column, value in enumerate(values):
+            self._sums[first + 1 + column] += value
+        self._pending[slot] += 1
+        if self._pending[slot] == self._factor:
+            self.older.append(slot, *[self._sums[index] / self._factor
+                                      for index in range(first, first + self._columns + 1)])
+            for index in range(first, first + self._columns + 1):
+                self._sums[index] = 0.0
+            self._pending[slot] = 0
+
+    def length(self, slot):
+        return self._count[slot]
+
+    def samples(self, slot, column=0):
+        """ Return the (timestamp, value) samples of a column of a slot, oldest first.
+        """
+        values = self._values[column]
+        return [(self._times[offset], values[offset])
+                for offset in (self._offset(slot, age) for age in range(self._count[slot] - 1, -1, -1))]
+
+    def rate(self, slot, column=0, samples=None):
+        """ Change per second of a column of a slot, like RingBuffer.rate.
+        """
+        count = self._count[slot] if samples is None else min(samples, self._count[slot])
+        if count < 2:
+            return None
+        newest = self._offset(slot, 0)
+        oldest = self._offset(slot, count - 1)
+        elapsed = self._times[newest] - self._times[oldest]
+        if elapsed <= 0:
+            return None
+        values = self._values[column]
+        return (values[newest] - float(values[oldest])) / elapsed
+
+    def values(self, slot, column=0):
+        """ Return the values of a column of a slot, oldest first, downsampled ones before the recent ones.
+        """
+        recent = self.samples(slot, column)
+        if self.older is None:
+            return [value for _, value in recent]
+        start = recent[0][0] if recent else None
+        older = [value for timestamp, value in self.older.samples(slot, column) if start is None or timestamp < start]
+        return older + [value for _, value in recent]
+
+    def series(self, slot):
+        return Series(self, slot)
+
+    def _offset(self, slot, age):
+        return slot * self._size + (self._next[slot] - 1 - age) % self._size
+
+
+class Series(object):
+    """ The history of one slot of a ColumnarHistory, with the interface of a MetricHistory.
+    """
+
+    __slots__ = ('_history', '_slot')
+
+    def __init__(self, history, slot):
+        self._history = history
+        self._slot = slot
+
+    def __len__(self):
+        return self._history.length(self._slot)
+
+    def rate(self, column=0, samples=None):
+        return self._history.rate(self._slot, column, samples)
+
+    def values(self, column=0):
+        return self._history.values(self._slot, column)
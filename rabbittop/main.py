@@ -28,97 +28,388 @@ import curses
 import sys
 import time
 
-from rabbittop import _rabbitmq, terminal, utils
-
-# Thresholds
-memory_treshold_warning = 75
-memory_treshold_error = 95
-
-disk_space_treshold_warning = 75
-disk_space_treshold_error = 95
-
-process_threshold_warning = 75
-process_threshold_error = 95
-
-socket_threshold_warning = 75
-socket_threshold_error = 95
-
-messages_ready_warning = 10
-messages_ready_error = 15
-
-messages_unack_warning = 10
-messages_unack_error = 15
+from rabbittop import _rabbitmq, cluster, metrics, queue_view, recording, rules, terminal, timing, utils
+from rabbittop.poller import MAX_INTERVAL, MIN_INTERVAL
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('host', help='Rabbit host to monitor')
+    parser.add_argument('host', help='Rabbit hosts to monitor', nargs='*')
+    parser.add_argument('--history', help='Refreshes of node history kept at full resolution', type=int,
+                        default=_rabbitmq.NODE_HISTORY)
+    parser.add_argument('--queue-history', help='Refreshes of queue history kept at full resolution', type=int,
+                        default=_rabbitmq.RATE_SAMPLES)
+    parser.add_argument('--queue-downsample', help='Also keep queue history at one point per %d refreshes, reaching '
+                        'further back at twice the memory per queue' % _rabbitmq.DOWNSAMPLE, action='store_true')
+    parser.add_argument('--record', help='Record snapshots of the (first) cluster to this file instead of showing them',
+                        metavar='FILE', default=None)
+    parser.add_argument('--replay', help='Show a recording made with --record instead of a live cluster',
+                        metavar='FILE', default=None)
+    parser.add_argument('--speed', help='Playback speed of a replay, </> change it', type=float, default=1)
+    parser.add_argument('--serve-metrics', help='Serve Prometheus metrics of the clusters at http://HOST:PORT/metrics, '
+                        'HOST defaults to 127.0.0.1', metavar='[HOST:]PORT', default=None)
+    parser.add_argument('--no-ui', help='With --serve-metrics, only serve the metrics', action='store_true')
+    parser.add_argument('--top', help='Only keep the top N queues, sorted and limited by the api (RabbitMQ 3.6+)',
+                        metavar='N', type=int, default=None)
+    parser.add_argument('--by', help='What --top ranks queues by', choices=list(_rabbitmq.TOP_FIELDS), default='ready')
+    parser.add_argument('--topology-ttl', help='Seconds the exchanges and bindings are cached for, r fetches them again',
+                        type=float, default=_rabbitmq.TOPOLOGY_TTL)
+    parser.add_argument('--node-ttl', help='Seconds the memory breakdown of the selected node is cached for', type=float,
+                        default=_rabbitmq.NODE_DETAIL_TTL)
+    parser.add_argument('--rules', help='File with warning and error thresholds of the node, message and queue stats',
+                        metavar='FILE', default=None)
+    parser.add_argument('--alert-command', help='Run this shell command with a line per queue that changed severity '
+                        'on its stdin', metavar='COMMAND', default=None)
+    parser.add_argument('--timings', help='Time the stages of every refresh, t toggles the footer showing them',
+                        action='store_true')
+    parser.add_argument('--profile', help='Write cProfile stats of all threads to this file on exit',
+                        metavar='FILE', default=None)
+    parser.add_argument('-c', '--config', help='Config file with the clusters to monitor', default=None)
     parser.add_argument('-v', '--vhost', help='vhost to monitor', default=None)
     parser.add_argument('-u', '--user', help='user', default='guest')
     parser.add_argument('-pw', '--password', help='password', default='guest')
     parser.add_argument('-p', '--port', help='Management ui port', default=15672)
+    parser.add_argument('--spread', help='Discover the nodes of the cluster and spread api calls over their management '
+                        'listeners, failing over when one is down', action='store_true')
+    parser.add_argument('-s', '--ssl', help='Use https for the management ui', action='store_true')
+    parser.add_argument('-t', '--timeout', help='Timeout in seconds for api calls', type=float, default=10)
+    parser.add_argument('-i', '--interval', help='Seconds between refreshes', type=float, default=3)
+    parser.add_argument('--min-interval', help='Never poll an endpoint more often than this many seconds', type=float,
+                        default=MIN_INTERVAL)
+    parser.add_argument('--max-interval', help='Never back off further than this many seconds', type=float,
+                        default=MAX_INTERVAL)
+    parser.add_argument('--page-size', help='Fetch queues in pages of this size, at most %d (RabbitMQ 3.6+)' %
+                        _rabbitmq.MAX_PAGE_SIZE, type=int, default=0)
 
     parsed_args = parser.parse_args()
-    sys.exit(curses.wrapper(run, parsed_args))
+    if not parsed_args.host and not parsed_args.config and not parsed_args.replay:
+        parser.error('give at least one host, a config file or a recording to replay')
+    profiler = timing.Profiler(parsed_args.profile) if parsed_args.profile else None
+    try:
+        if parsed_args.record:
+            result = _record(parsed_args)
+        elif parsed_args.serve_metrics and parsed_args.no_ui:
+            result = _serve_metrics(parsed_args)
+        else:
+            result = curses.wrapper(run, parsed_args)
+    finally:
+        if profiler:
+            profiler.dump()
+    sys.exit(result)
+
+
+def _record(args):
+    """ Headless mode, record the first cluster until interrupted
+    """
+    _cluster = cluster.from_args(args)[0]
+    print('Recording %s to %s every %gs, stop with ctrl-c' % (_cluster.name, args.record, _cluster.poller.interval))
+    recording.record(_cluster.client, args.record, _cluster.poller.interval, vhost=_cluster.rabbit.vhost,
+                     timeout=_cluster.client.timeout)
+    _cluster.client.close()
+
+
+def _serve_metrics(args):
+    """ Headless mode, poll the clusters and serve their metrics until interrupted
+    """
+    clusters = cluster.from_args(args)
+    server = _metrics_server(clusters, args.serve_metrics)
+    for _cluster in clusters:
+        _cluster.start()
+    print('Serving the metrics of %s at http://%s:%d/metrics, stop with ctrl-c' % (
+        ', '.join(_cluster.name for _cluster in clusters), server.host, server.port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        for _cluster in clusters:
+            _cluster.stop()
+
+
+def _metrics_server(clusters, address):
+    """ Serve the metrics of the clusters at [host:]port, the pollers must not have been started yet
+    """
+    host, _, port = address.rpartition(':')
+    return metrics.MetricsServer(clusters, int(port), host or '127.0.0.1').start()
 
 
 def run(scrn, args):
     term = terminal.Terminal(scrn=scrn)
     atexit.register(term.stop)
+    clusters = cluster.from_args(args)
+    if args.serve_metrics:
+        atexit.register(_metrics_server(clusters, args.serve_metrics).stop)
+    for _cluster in clusters:
+        atexit.register(_cluster.stop)
+        _cluster.start()
+
+    selected = 0
+    generations = None
+    drawn_at = None
+    redraw = True
+    show_timings = args.timings
+    editing = False
+    # What is shown below the cluster stats: queues, exchanges, node (the selected one), connections or channels
+    screen = 'queues'
     while True:
-        rabbit = _rabbitmq.Rabbit(args.host, args.user, args.password, args.port, vhost=args.vhost)
-        term.refresh()
-        term.add_line(
-            'rabbitmq-%s - erlang-%s - %s - %s' % (
-                rabbit.version,
-                rabbit.erlang_version,
-                rabbit.cluster_name,
-                time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime())
-            ),
-            0, 0,
-            color=term.colors['TITLE']
-        )
-        line_index = 0
-        for node in rabbit.nodes:
-            line_index += 1
-            node_line = '%s - type: %s - pid: %s - uptime: %s --' % (node.name, node.type, node.pid, str(node.uptime))
-            term.add_line(node_line, line_index, 0, term.colors['TITLE'])
-            column_count = len(node_line) + 1
-            line_index, column_count = _disk_free(term, node, line_index, column_count)
-            line_index, column_count = _mem_free(term, node, line_index, column_count+1)
-            line_index, column_count = _process_free(term, node, line_index, column_count+1)
-            line_index, column_count = _socket_count(term, node, line_index, column_count+1)
-
-        line_index += 1
-        column_count = 0
-        line_index, column_count = _msg_rate(term, rabbit, line_index, column_count)
-        line_index += 1
-        column_count = 0
-        line_index, column_count = _delivery_details(term, rabbit, line_index, column_count)
-        line_index += 1
-        column_count = 0
-        line_index, column_count = _object_details(term, rabbit, line_index, column_count)
-        line_index += 1
-        column_count = 0
-
-        _queue_details(term, rabbit, line_index, column_count)
-
-        # todo: Add filtering possibilities
-        #term.add_line("[a]ctive queues only", term.get_size()[0] - 1, 0, term.colors['REVERSE'])
+        rabbit = clusters[selected].rabbit
+        snapshots = [_cluster.poller.latest() for _cluster in clusters]
+        if [snapshot and snapshot.generation for snapshot in snapshots] != generations:
+            generations = [snapshot and snapshot.generation for snapshot in snapshots]
+            redraw = True
+        # Redraw at least once a second for the clock in the title
+        if redraw or int(time.time()) != drawn_at:
+            line_index = 0
+            if len(clusters) > 1:
+                line_index = _cluster_summary(term, clusters, selected)
+            timings = clusters[selected].timings
+            started = time.time()
+            draw(term, rabbit, clusters[selected].poller, line_index, clusters[selected].player, editing, screen,
+                 clusters[selected].alerts)
+            if timings and show_timings:
+                term.add_line(timings.summary(), term.get_size()[0] - 1, 0, term.colors['TITLE'])
+            term.refresh()
+            if timings:
+                timings.add('draw', time.time() - started)
+            drawn_at = int(time.time())
+            redraw = False
 
         char = term.getch()
-        if char == curses.KEY_UP:
-            term.panels['queues'].scroll_up()
-        elif char == curses.KEY_DOWN:
-            term.panels['queues'].scroll_down()
+        if char == -1:
+            continue
+        redraw = True
+        if char == curses.KEY_RESIZE:
+            term.resized()
+        elif editing:
+            editing = _edit_filter(rabbit, char)
+            _queues_reordered(term, clusters[selected])
+        elif char in _scroll_keys:
+            _scroll_keys[char](term.views[screen])
+            if screen == 'queues':
+                rabbit.set_window(term.views['queues'].offset, term.views['queues'].height)
+                if not rabbit.window_loaded:
+                    clusters[selected].poller.poll_now()
+        elif char in (ord('\t'), curses.KEY_BTAB):
+            selected = (selected + (1 if char == ord('\t') else -1)) % len(clusters)
+            # The selected node belongs to the previous cluster
+            screen = _show(clusters, selected, 'queues' if screen == 'node' else screen)
+            term.views[screen].offset = 0
+        elif char in _replay_keys and clusters[selected].player:
+            _replay_keys[char](clusters[selected].player)
+            clusters[selected].poller.poll_now()
+        elif char == ord('e'):
+            screen = _show(clusters, selected, 'exchanges' if screen != 'exchanges' else 'queues')
+        elif char == ord('c'):
+            # Queues, connections, channels and back
+            following = {'connections': 'channels', 'channels': 'queues'}
+            screen = _show(clusters, selected, following.get(screen, 'connections'))
+        elif char == ord('n'):
+            # The next node, after the last one back to the queues
+            names = [node.name for node in rabbit.nodes]
+            current = rabbit.node_detail.node_name if screen == 'node' else None
+            following = names[names.index(current) + 1:] if current in names else names
+            screen = _show(clusters, selected, 'node' if following else 'queues', following[0] if following else None)
+        elif char == ord('t'):
+            show_timings = not show_timings
+        elif char == ord('/'):
+            editing = True
+        elif char == ord('s') and screen == 'connections':
+            connections = rabbit.connections
+            connections.grouping = 'user' if connections.grouping == 'peer_host' else 'peer_host'
+            term.views[screen].offset = 0
+        elif char == ord('s') and screen == 'channels':
+            rabbit.channels.set_order(_next(list(_rabbitmq.CHANNEL_ORDERS), rabbit.channels.order))
+            term.views[screen].offset = 0
+            clusters[selected].poller.poll_now()
+        elif char == ord('s'):
+            columns = [None] + list(queue_view.SORT_COLUMNS)
+            rabbit.sort = columns[(columns.index(rabbit.sort) + 1) % len(columns)]
+            # Numbers are sorted largest first
+            rabbit.sort_reverse = queue_view.SORT_COLUMNS.get(rabbit.sort, False)
+            _queues_reordered(term, clusters[selected])
+        elif char == ord('S'):
+            rabbit.sort_reverse = not rabbit.sort_reverse
+            _queues_reordered(term, clusters[selected])
         elif char == ord('a'):
             rabbit.active_queues = True if not rabbit.active_queues else False
+            _queues_reordered(term, clusters[selected])
+        elif char in (ord('+'), ord('-'), ord('r')):
+            for _cluster in clusters:
+                poller = _cluster.poller
+                if char == ord('+'):
+                    poller.set_interval(poller.interval + 1)
+                elif char == ord('-'):
+                    poller.set_interval(max(poller.interval - 1, min(poller.interval, 1)))
+                else:
+                    _cluster.rabbit.invalidate_cached()
+                    poller.poll_now()
         elif char == ord('q'):
+            for _cluster in clusters:
+                _cluster.stop()
             term.stop()
             break
 
 
-def _disk_free(term, node, line_index, column_count):
+def _show(clusters, selected, screen, node_name=None):
+    """ Switch to a screen, return it. Only what a screen shows is fetched: the topology for the exchanges, the
+    detail of node_name of the selected cluster for the node, the connections or channels for theirs.
+    """
+    for index, _cluster in enumerate(clusters):
+        _cluster.rabbit.topology.wanted = screen == 'exchanges'
+        _cluster.rabbit.node_detail.select(node_name if screen == 'node' and index == selected else None)
+        _cluster.rabbit.connections.wanted = screen == 'connections'
+        _cluster.rabbit.channels.wanted = screen == 'channels'
+    if clusters[selected].rabbit.cached_due():
+        clusters[selected].poller.poll_now()
+    return screen
+
+
+def _edit_filter(rabbit, char):
+    """ Apply a key typed in the queue filter, return False when editing is done
+    """
+    text = rabbit.filter.text
+    if char in (ord('\n'), ord('\r'), curses.KEY_ENTER):
+        return False
+    elif char == 27:
+        # Escape clears the filter
+        rabbit.filter = queue_view.Filter('', rabbit.filter.active)
+        return False
+    elif char in (curses.KEY_BACKSPACE, 127, 8):
+        text = text[:-1]
+    elif 32 <= char < 127:
+        text += chr(char)
+    rabbit.filter = queue_view.Filter(text, rabbit.filter.active)
+    return True
+
+
+def _queues_reordered(term, _cluster):
+    """ Scroll back to the top after the filter or sort order changed, with paging the api has to list them again
+    """
+    view = term.views.get('queues')
+    if view:
+        view.offset = 0
+        _cluster.rabbit.set_window(view.offset, view.height)
+    if not _cluster.rabbit.queues_complete:
+        _cluster.poller.poll_now()
+
+
+_scroll_keys = {
+    curses.KEY_UP: terminal.ListView.scroll_up,
+    curses.KEY_DOWN: terminal.ListView.scroll_down,
+    curses.KEY_PPAGE: terminal.ListView.page_up,
+    curses.KEY_NPAGE: terminal.ListView.page_down,
+}
+
+_replay_keys = {
+    ord(' '): lambda player: player.pause(),
+    ord('<'): lambda player: player.set_speed(player.speed / 2),
+    ord('>'): lambda player: player.set_speed(player.speed * 2),
+    curses.KEY_LEFT: lambda player: player.skip(-60),
+    curses.KEY_RIGHT: lambda player: player.skip(60),
+    curses.KEY_HOME: lambda player: player.seek(player.start),
+    curses.KEY_END: lambda player: player.seek(player.end),
+}
+
+
+def _cluster_summary(term, clusters, selected):
+    """ Display a summary row per cluster, the selected one is shown in detail below
+    """
+    for line_index, _cluster in enumerate(clusters):
+        rabbit = _cluster.rabbit
+        messages = rabbit.messages
+        line = '%-20s rabbitmq-%s\tnodes: %d/%d\tready: %s\tunacked: %s\tqueues: %s\t' % (
+            _cluster.name[:20],
+            rabbit.version,
+            len([node for node in rabbit.nodes if node.running]),
+            len(rabbit.nodes),
+            messages.get('ready', {}).get('count', _rabbitmq.NOT_AVAILABLE),
+            messages.get('unacknowledged', {}).get('count', _rabbitmq.NOT_AVAILABLE),
+            rabbit.objects.get('queues', _rabbitmq.NOT_AVAILABLE),
+        )
+        problems = ['alarm: %s' % name for name in _cluster.alarms]
+        if rabbit.errors:
+            problems.append('unavailable: %s' % ', '.join(rabbit.errors))
+        color = 'REVERSE' if line_index == selected else 'CRITICAL_LOG' if problems else 'TITLE'
+        term.add_line(line + ' '.join(problems), line_index, 0, term.colors[color])
+    return len(clusters) + 1
+
+
+def draw(term, rabbit, poller=None, line_index=0, player=None, editing=False, screen='queues', alerts=None):
+    """ Draw one frame of the rabbit state from line_index on, it is shown by term.refresh()
+    """
+    rule_set = alerts.rules if alerts else rules.Rules()
+    title = 'rabbitmq-%s - erlang-%s - %s - %s' % (
+        rabbit.version,
+        rabbit.erlang_version,
+        rabbit.cluster_name,
+        time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime(player.frame_time if player else None))
+    )
+    if poller:
+        # Endpoints that are polled slower than the base interval because they are slow or failing
+        slower = ['%s %.3gs' % (endpoint, interval) for endpoint, interval in poller.intervals().items()
+                  if interval > poller.interval]
+        title += ' - every %gs%s' % (poller.interval, ' (%s)' % ', '.join(slower) if slower else '')
+    if rabbit.hosts:
+        health = rabbit.hosts.health()
+        down = [host for host, up in health if not up]
+        title += ' - api %d/%d up%s' % (len(health) - len(down), len(health), ' (down: %s)' % ', '.join(down) if down else '')
+    if rabbit.top:
+        title += ' - top %d by %s' % (rabbit.top, rabbit.top_by)
+    if player:
+        title += ' - replay x%g%s' % (player.speed, ' paused' if player.paused else '')
+    term.add_line(title, line_index, 0, color=term.colors['TITLE'])
+    if rabbit.errors:
+        term.add_line(' unavailable: %s ' % ', '.join(rabbit.errors), line_index, len(title) + 1,
+                      term.colors['CRITICAL_LOG'])
+    for node in rabbit.nodes:
+        line_index += 1
+        node_line = '%s - type: %s - pid: %s - uptime: %s --' % (node.name, node.type, node.pid, str(node.uptime))
+        term.add_line(node_line, line_index, 0, term.colors['TITLE'])
+        column_count = len(node_line) + 1
+        line_index, column_count = _disk_free(term, rule_set, node, line_index, column_count)
+        line_index, column_count = _mem_free(term, rule_set, node, line_index, column_count+1)
+        line_index, column_count = _process_free(term, rule_set, node, line_index, column_count+1)
+        line_index, column_count = _socket_count(term, rule_set, node, line_index, column_count+1)
+        line_index += 1
+        _node_trends(term, node, line_index)
+
+    line_index += 1
+    column_count = 0
+    line_index, column_count = _msg_rate(term, rule_set, rabbit, line_index, column_count)
+    line_index += 1
+    column_count = 0
+    line_index, column_count = _delivery_details(term, rabbit, line_index, column_count)
+    line_index += 1
+    column_count = 0
+    line_index, column_count = _object_details(term, rabbit, line_index, column_count)
+    line_index += 1
+    column_count = 0
+
+    if screen == 'exchanges':
+        _exchange_details(term, rabbit, line_index, column_count)
+    elif screen == 'node':
+        _node_detail(term, rabbit, line_index, column_count)
+    elif screen == 'connections':
+        _connection_details(term, rabbit, line_index, column_count)
+    elif screen == 'channels':
+        _channel_details(term, rabbit, line_index, column_count)
+    else:
+        _queue_details(term, rabbit, line_index, column_count, editing, alerts)
+
+
+def _node_trends(term, node, line_index):
+    """ Display sparklines of the node history
+    """
+    line = '    trends --'
+    for title, column in (('Mem', 0), ('Disk free', 1), ('Fd', 2), ('Sockets', 3)):
+        line += '  %s: [%s]' % (title, utils.sparkline(node.history.values(column), 20))
+    term.add_line(line, line_index, 0, term.colors['DEFAULT'])
+    return line_index, len(line)
+
+
+def _disk_free(term, rule_set, node, line_index, column_count):
     """ Display disk stats
     """
     title = ' Disk usage:'
@@ -134,20 +425,13 @@ def _disk_free(term, node, line_index, column_count):
         ' %s ' % data,
         line_index,
         column_count,
-        term.colors[
-            _calculate_color_percent(
-                node.disk_free_limit,
-                node.disk_free,
-                disk_space_treshold_warning,
-                disk_space_treshold_error
-            )
-        ]
+        term.colors[rules.STAT_COLORS[rule_set.node_severity(node, 'disk')]]
     )
     column_count += len(data)
     return line_index, column_count + 1
 
 
-def _mem_free(term, node, line_index, column_count):
+def _mem_free(term, rule_set, node, line_index, column_count):
     """ Display memory stats
     """
     title = ' Mem usage:'
@@ -163,20 +447,13 @@ def _mem_free(term, node, line_index, column_count):
         ' %s ' % data,
         line_index,
         column_count,
-        term.colors[
-            _calculate_color_percent(
-                node.mem_used,
-                node.mem_limit,
-                memory_treshold_warning,
-                memory_treshold_error
-            )
-        ]
+        term.colors[rules.STAT_COLORS[rule_set.node_severity(node, 'memory')]]
     )
     column_count += len(data)
     return line_index, column_count + 1
 
 
-def _process_free(term, node, line_index, column_count):
+def _process_free(term, rule_set, node, line_index, column_count):
     """ Display process stats
     """
     title = ' Process usage:'
@@ -192,20 +469,13 @@ def _process_free(term, node, line_index, column_count):
         ' %s ' % data,
         line_index,
         column_count,
-        term.colors[
-            _calculate_color_percent(
-                node.proc_used,
-                node.proc_totoal,
-                process_threshold_warning,
-                process_threshold_error
-            )
-        ]
+        term.colors[rules.STAT_COLORS[rule_set.node_severity(node, 'processes')]]
     )
     column_count += len(data)
     return line_index, column_count + 1
 
 
-def _socket_count(term, node, line_index, column_count):
+def _socket_count(term, rule_set, node, line_index, column_count):
     """ Display socket stats
     """
     title = ' Socket usage:'
@@ -221,20 +491,13 @@ def _socket_count(term, node, line_index, column_count):
         ' %s ' % data,
         line_index,
         column_count,
-        term.colors[
-            _calculate_color_percent(
-                node.sockets_used,
-                node.sockets_total,
-                socket_threshold_warning,
-                socket_threshold_error
-            )
-        ]
+        term.colors[rules.STAT_COLORS[rule_set.node_severity(node, 'sockets')]]
     )
     column_count += len(data)
     return line_index, column_count + 1
 
 
-def _msg_rate(term, rabbit, line_index, column_count):
+def _msg_rate(term, rule_set, rabbit, line_index, column_count):
     """ Display message stats
     """
     title = 'Message rates \t '
@@ -257,77 +520,199 @@ def _msg_rate(term, rabbit, line_index, column_count):
             data,
             line_index,
             column_count,
-            term.colors[
-                _calculate_color_values(
-                    value['count'],
-                    socket_threshold_warning,
-                    socket_threshold_error
-                )
-            ]
+            term.colors[rules.STAT_COLORS[rule_set.severity('messages', key, value['count'])]]
         )
         column_count += len(data) + 1
 
     return line_index, column_count + 1
 
 
-def _calculate_color_percent(low_value, max_value, threshold_warning, threshold_error):
-    """ Calculate the color for a given value and warning and threshold values according to a percentage
+def _queue_details(term, rabbit, line_index, column_count, editing=False, alerts=None):
+    """ Display queue stats in a scrollable view, only the visible rows are formatted, colored by their severity
     """
-    percent = (float(low_value) / float(max_value)) * 100
-    if percent >= threshold_warning and percent <= threshold_error:
-        return 'CRITICAL'
-    elif percent >= threshold_error:
-        return 'CRITICAL_LOG'
-    return 'OK'
+    queues = rabbit.queues
+    height, width = term.get_size()
 
+    view = term.views.get('queues') or term.create_view('queues')
+
+    status = ''
+    if rabbit.sort:
+        status += ' sort: %s %s ' % (rabbit.sort, 'desc' if rabbit.sort_reverse else 'asc')
+    if rabbit.filter.text or editing:
+        status += ' filter: %s%s ' % (rabbit.filter.text, '_' if editing else '')
+    if alerts:
+        _, warnings, errors = alerts.counts
+        if warnings or errors:
+            status += ' %d error, %d warning ' % (errors, warnings)
+    term.add_line("\t\t\toverview\t\t\t\tmessages\t\t\trates\t%s\t\t\t" % (status,), line_index, 0,
+                  term.colors['REVERSE'])
+    line_index += 1
+    term.add_line("NAME\tVHOST\tEXCL\tPARAMS\tPOLICY\tSTATE\t\tREADY\tUNACK\tTOTAL\t\tINC\tDELIVER/GET\tACK\tREADY/UNACK TREND", line_index, 0, term.colors['TITLE'])
+    line_index += 1
 
-def _calculate_color_values(value, threshold_warning, threshold_error):
-    """ Calculate the color for a given value and warning and threshold values according to a value
-    """
-    if value >= threshold_warning and value <= threshold_error:
-        return 'CRITICAL'
-    elif value >= threshold_error:
-        return 'CRITICAL_LOG'
-    return 'OK'
+    # With paging only a window of the queues is known, it starts at queue_offset
+    row_count = len(queues) if rabbit.queues_complete else rabbit.queue_count
+
+    def _queue_row(index):
+        # todo: support highlighting of queues
+        index -= rabbit.queue_offset
+        if not 0 <= index < len(queues):
+            return '...', term.colors['NICE']
+        queue = queues[index]
+        color = rules.ROW_COLORS[alerts.severity(queue) if alerts else rules.OK]
+        return "%s\t%s\t%s\t%s\t%s\t%s\t\t%s\t%s\t%s\t\t%s\t%s\t\t%s\t%s %s" % (
+            queue.name, queue.vhost, queue.exclusive, queue.params, queue.policy, queue.state, queue.ready, queue.unacked,
+            queue.total, queue.total_rate, queue.ready_rate, queue.unacked_rate,
+            utils.sparkline(queue.history.values(0), 8), utils.sparkline(queue.history.values(1), 8)), term.colors[color]
+
+    view.resize(line_index, height - line_index - 1)
+    view.set_rows(row_count, _queue_row)
+    view.draw()
+    rabbit.set_window(view.offset, view.height)
+    return line_index + view.height, column_count
 
 
-def _queue_details(term, rabbit, line_index, column_count):
-    """ Display queue stats in a scrollable panel
+def _exchange_details(term, rabbit, line_index, column_count):
+    """ Display the exchanges with their publish rates and the queues they route to
     """
-    queues = rabbit.queues
+    topology = rabbit.topology
+    exchanges = topology.exchanges
     height, width = term.get_size()
-    panel_height = max(height - line_index, len(queues))
 
-    panel = term.panels.get('queues') or term.create_panel('queues', panel_height - line_index - 2, width)
+    view = term.views.get('exchanges') or term.create_view('exchanges')
 
-    term.add_line("\t\t\toverview\t\t\t\tmessages\t\t\trates\t\t\t\t", line_index, 0, term.colors['REVERSE'])
+    age = topology.age
+    status = ' fetching ' if age is None else ' as of %ds ago, r refreshes ' % age
+    term.add_line("\t\t\texchanges\t\t\tpublish rates\t%s\t\t\t" % (status,), line_index, 0, term.colors['REVERSE'])
     line_index += 1
-    term.add_line("NAME\tVHOST\tEXCL\tPARAMS\tPOLICY\tSTATE\t\tREADY\tUNACK\tTOTAL\t\tINC\tDELIVER/GET\tACK\t", line_index, 0, term.colors['TITLE'])
+    term.add_line("%-32s%-16sTYPE\tIN\tOUT\tROUTES TO" % ('NAME', 'VHOST'), line_index, 0, term.colors['TITLE'])
     line_index += 1
 
-    _old_line_index = line_index
-    line_index = 0
+    def _exchange_row(index):
+        exchange = exchanges[index]
+        routes = ', '.join(exchange.routes)
+        if not exchange.name:
+            routes = 'every queue by name'
+        return "%-31s %-15s %s\t%s\t%s\t%s" % (
+            exchange.name or '(default)', exchange.vhost, exchange.type, exchange.rate_in, exchange.rate_out,
+            routes), term.colors['NICE']
 
-    if term.selected_row is None:
-        term.selected_row = line_index
+    view.resize(line_index, height - line_index - 1)
+    view.set_rows(len(exchanges), _exchange_row)
+    view.draw()
+    return line_index + view.height, column_count
 
-    for queue in queues:
-        # todo: support highlighting of queues
-        #color = 'NICE' if line_index != term.selected_row else 'CAREFUL_LOG'
-        panel.add_line("%s\t%s\t%s\t%s\t%s\t%s\t\t%s\t%s\t%s\t\t%s\t%s\t\t%s\t" % (
-            queue.name, queue.vhost, queue.exclusive, queue.params, queue.policy, queue.state, queue.ready, queue.unacked,
-            queue.total, queue.total_rate, queue.ready_rate, queue.unacked_rate),
-            line_index, 0,
-            term.colors['NICE']
-        )
+
+def _node_detail(term, rabbit, line_index, column_count):
+    """ Display the selected node with its alarms, trends and memory breakdown
+    """
+    detail = rabbit.node_detail
+    node = dict((node.name, node) for node in rabbit.nodes).get(detail.node_name)
+    height, width = term.get_size()
+
+    view = term.views.get('node') or term.create_view('node')
+
+    age = detail.age
+    status = ' fetching ' if age is None else ' memory as of %ds ago, n next node ' % age
+    term.add_line("\t\t\tnode %s\t\t\t%s\t\t\t" % (detail.node_name, status), line_index, 0, term.colors['REVERSE'])
+    line_index += 1
+    if node:
+        alarms = [name for name, raised in (('memory', node.mem_alarm), ('disk', node.disk_free_alarm)) if raised]
+        term.add_line('Alarms: %s\tMem limit: %s\tDisk free limit: %s\tProcesses: %s/%s\tRun queue: %s\tProcessors: %s' % (
+            ', '.join(alarms) or 'none', utils.human_size(node.mem_limit), utils.human_size(node.disk_free_limit),
+            node.proc_used, node.proc_totoal, detail.status.get('run_queue', _rabbitmq.NOT_AVAILABLE),
+            detail.status.get('processors', _rabbitmq.NOT_AVAILABLE)),
+            line_index, 0, term.colors['CRITICAL_LOG' if alarms else 'TITLE'])
         line_index += 1
+        latest = (utils.human_size(node.mem_used), utils.human_size(node.disk_free), node.fd, node.sockets_used,
+                  node.proc_used)
+        for column, title in enumerate(('Mem', 'Disk free', 'Fd', 'Sockets', 'Processes')):
+            term.add_line('%-10s [%s] %s' % (title, utils.sparkline(node.history.values(column), 60), latest[column]),
+                          line_index, 0, term.colors['DEFAULT'])
+            line_index += 1
+
+    memory = detail.memory
+    total = sum(value for _, value in memory)
+    term.add_line("%-24s%10s%8s" % ('MEMORY', 'SIZE', 'SHARE'), line_index, 0, term.colors['TITLE'])
+    line_index += 1
+
+    def _memory_row(index):
+        category, value = memory[index]
+        share = value * 100.0 / total if total else 0
+        return '%-24s%10s%7.1f%%  %s' % (category, utils.human_size(value), share, '#' * int(share / 2)), term.colors['NICE']
+
+    view.resize(line_index, height - line_index - 1)
+    view.set_rows(len(memory), _memory_row)
+    view.draw()
+    return line_index + view.height, column_count
+
+
+def _connection_details(term, rabbit, line_index, column_count):
+    """ Display the connections per peer host or per user
+    """
+    connections = rabbit.connections
+    groups = connections.groups[connections.grouping]
+    height, width = term.get_size()
+
+    view = term.views.get('connections') or term.create_view('connections')
+
+    by, other = ('peer host', 'USERS') if connections.grouping == 'peer_host' else ('user', 'HOSTS')
+    age = connections.age
+    status = ' fetching ' if age is None else ' %d%s connections as of %ds ago, s groups by %s ' % (
+        connections.count, '+' if connections.partial else '', age,
+        'user' if connections.grouping == 'peer_host' else 'peer host')
+    term.add_line("\t\t\tconnections by %s\t\t\t%s\t\t\t" % (by, status), line_index, 0, term.colors['REVERSE'])
+    line_index += 1
+    term.add_line("%-40s%12s%10s%14s%14s%8s" % (by.upper(), 'CONNECTIONS', 'CHANNELS', 'RECV B/S', 'SEND B/S', other),
+                  line_index, 0, term.colors['TITLE'])
+    line_index += 1
+
+    def _group_row(index):
+        group = groups[index]
+        return "%-39s %12s%10s%14s%14s%8s" % (
+            group.key, group.connections, group.channels, utils.human_size(group.recv_rate),
+            utils.human_size(group.send_rate), group.others), term.colors['NICE']
+
+    view.resize(line_index, height - line_index - 1)
+    view.set_rows(len(groups), _group_row)
+    view.draw()
+    return line_index + view.height, column_count
+
+
+def _channel_details(term, rabbit, line_index, column_count):
+    """ Display the channels with the most unacknowledged messages, prefetch or message rates
+    """
+    top = rabbit.channels
+    channels = top.channels
+    height, width = term.get_size()
+
+    view = term.views.get('channels') or term.create_view('channels')
+
+    age = top.age
+    status = ' fetching ' if age is None else ' as of %ds ago, s orders by %s ' % (
+        age, _next(list(_rabbitmq.CHANNEL_ORDERS), top.order))
+    term.add_line("\t\t\ttop %d channels by %s\t\t\t%s\t\t\t" % (len(channels), top.order, status), line_index, 0,
+                  term.colors['REVERSE'])
+    line_index += 1
+    term.add_line("%-48s%-16s%-16s%8s%9s%10s%9s%9s%9s" % (
+        'NAME', 'USER', 'VHOST', 'UNACKED', 'PREFETCH', 'CONSUMERS', 'PUBLISH', 'DELIVER', 'ACK'),
+        line_index, 0, term.colors['TITLE'])
+    line_index += 1
+
+    def _channel_row(index):
+        channel = channels[index]
+        return "%-47s %-15s %-15s %8s%9s%10s%9s%9s%9s" % (
+            channel.name, channel.user, channel.vhost, channel.unacked, channel.prefetch, channel.consumers,
+            channel.publish_rate, channel.deliver_rate, channel.ack_rate), term.colors['NICE']
+
+    view.resize(line_index, height - line_index - 1)
+    view.set_rows(len(channels), _channel_row)
+    view.draw()
+    return line_index + view.height, column_count
+
 
-    # first 2 arguments what to show of the panel
-    # second 2 arguments where to show the panel on the screen
-    # last 2 arguments until where to show it.
-    panel.refresh(panel.ptopy, 0, _old_line_index, 0, height - _old_line_index - 2, width)
-    panel.set_max(panel_height - (height - _old_line_index))
-    return _old_line_index + line_index, column_count
+def _next(values, value):
+    return values[(values.index(value) + 1) % len(values)]
 
 
 def _object_details(term, rabbit, line_index, column_count):
@@ -0,0 +1,247 @@
+""" Prometheus metrics of the polled clusters
+"""
+import BaseHTTPServer
+import SocketServer
+import collections
+import functools
+import gzip
+import io
+import threading
+
+import logging
+
+from rabbittop._rabbitmq import NOT_AVAILABLE, SECTIONS
+
+_log = logging.getLogger()
+
+# Version 0.0.4 of the text format, the one every Prometheus version scrapes
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Cluster totals: metric name, help and the key and field in Rabbit.messages
+OVERVIEW_METRICS = [
+    ('rabbitmq_messages', 'Messages in all queues', 'total', 'count'),
+    ('rabbitmq_messages_ready', 'Messages ready for delivery in all queues', 'ready', 'count'),
+    ('rabbitmq_messages_unacknowledged', 'Messages delivered but not acknowledged in all queues',
+     'unacknowledged', 'count'),
+    ('rabbitmq_messages_rate', 'Change of the messages in all queues per second', 'total', 'rate'),
+    ('rabbitmq_messages_ready_rate', 'Change of the ready messages in all queues per second', 'ready', 'rate'),
+    ('rabbitmq_messages_unacknowledged_rate', 'Change of the unacknowledged messages in all queues per second',
+     'unacknowledged', 'rate'),
+]
+
+# Metric name, help and the Node attribute
+NODE_METRICS = [
+    ('rabbitmq_node_running', 'Whether the node is running', 'running'),
+    ('rabbitmq_node_uptime_seconds', 'Uptime of the node', 'uptime'),
+    ('rabbitmq_node_mem_used_bytes', 'Memory used by the node', 'mem_used'),
+    ('rabbitmq_node_mem_limit_bytes', 'Memory high watermark of the node', 'mem_limit'),
+    ('rabbitmq_node_mem_alarm', 'Whether the memory alarm of the node is raised', 'mem_alarm'),
+    ('rabbitmq_node_disk_free_bytes', 'Free disk space of the node', 'disk_free'),
+    ('rabbitmq_node_disk_free_limit_bytes', 'Free disk space below which the node raises an alarm', 'disk_free_limit'),
+    ('rabbitmq_node_disk_free_alarm', 'Whether the disk alarm of the node is raised', 'disk_free_alarm'),
+    ('rabbitmq_node_fd_used', 'File descriptors used by the node', 'fd'),
+    ('rabbitmq_node_fd_total', 'File descriptors available to the node', 'fd_total'),
+    ('rabbitmq_node_sockets_used', 'Sockets used by the node', 'sockets_used'),
+    ('rabbitmq_node_sockets_total', 'Sockets available to the node', 'sockets_total'),
+    ('rabbitmq_node_proc_used', 'Erlang processes used by the node', 'proc_used'),
+    ('rabbitmq_node_proc_total', 'Erlang processes available to the node', 'proc_totoal'),
+]
+
+# Metric name, help and the RabbitQueue attribute
+QUEUE_METRICS = [
+    ('rabbitmq_queue_messages', 'Messages in the queue', 'total'),
+    ('rabbitmq_queue_messages_ready', 'Messages ready for delivery in the queue', 'ready'),
+    ('rabbitmq_queue_messages_unacknowledged', 'Messages delivered but not acknowledged in the queue', 'unacked'),
+    ('rabbitmq_queue_messages_rate', 'Change of the messages in the queue per second', 'total_rate'),
+    ('rabbitmq_queue_messages_ready_rate', 'Change of the ready messages in the queue per second', 'ready_rate'),
+    ('rabbitmq_queue_messages_unacknowledged_rate', 'Change of the unacknowledged messages in the queue per second',
+     'unacked_rate'),
+]
+
+# Metrics with a label per key of a Rabbit dict: name, help, label and the Rabbit attribute
+DICT_METRICS = [
+    ('rabbitmq_objects', 'Objects in the cluster', 'type', 'objects'),
+    ('rabbitmq_message_stats_rate', 'Messages per second by operation', 'operation', 'details'),
+]
+
+# Metrics of rabbittop itself
+OWN_METRICS = [
+    ('rabbittop_endpoint_up', 'Whether the last poll of the api endpoint succeeded'),
+    ('rabbittop_endpoint_duration_seconds', 'Duration of the last poll of the api endpoint'),
+]
+
+# Help of every metric, in the order of the exposition
+FAMILIES = collections.OrderedDict(
+    [(metric[0], metric[1]) for metrics in (OVERVIEW_METRICS, DICT_METRICS, NODE_METRICS, QUEUE_METRICS, OWN_METRICS)
+     for metric in metrics])
+
+
+class ClusterMetrics(object):
+    """ The samples of one cluster, rendered after every refresh.
+
+    Label values are utf-8 encoded as the lines are rendered, so they can
+    be joined into the exposition as they are. The lines of a queue are
+    kept, by the id of the queue object which lives as long as the queue,
+    and only the queues in the Changeset of a refresh are rendered again.
+    A quiet cluster with many queues costs little more than joining
+    strings.
+    """
+
+    def __init__(self, name):
+        self._labels = 'cluster="%s"' % _escape(name)
+        self._queue_samples = {}
+        self._durations = {}
+        # Rendered samples by metric name
+        self.families = {}
+
+    def update(self, rabbit, changeset):
+        """ Render the samples of rabbit, changeset holds the queues changed since the last update.
+        """
+        samples = collections.defaultdict(list)
+        for name, _, key, field in OVERVIEW_METRICS:
+            samples[name].append(_sample(name, self._labels, rabbit.messages.get(key, {}).get(field)))
+        for name, _, label, attribute in DICT_METRICS:
+            for key, value in sorted(getattr(rabbit, attribute).items()):
+                labels = '%s,%s="%s"' % (self._labels, label, _escape(key.lower()))
+                samples[name].append(_sample(name, labels, value))
+        for node in rabbit.nodes:
+            labels = '%s,node="%s"' % (self._labels, _escape(node.name))
+            for name, _, attribute in NODE_METRICS:
+                value = getattr(node, attribute)
+                if attribute == 'uptime' and value != NOT_AVAILABLE:
+                    value = value.total_seconds()
+                samples[name].append(_sample(name, labels, value))
+
+        self._durations.update(rabbit.durations)
+        for endpoint in SECTIONS:
+            labels = '%s,endpoint="%s"' % (self._labels, endpoint)
+            samples['rabbittop_endpoint_up'].append(
+                _sample('rabbittop_endpoint_up', labels, endpoint not in rabbit.errors))
+            samples['rabbittop_endpoint_duration_seconds'].append(
+                _sample('rabbittop_endpoint_duration_seconds', labels, self._durations.get(endpoint)))
+
+        if changeset is not None:
+            for queue in changeset.removed:
+                self._queue_samples.pop(id(queue), None)
+            for queue in changeset.added + changeset.changed:
+                self._queue_samples[id(queue)] = self._render_queue(queue)
+        # A queue listed before its Changeset arrived (a refresh that timed out) is left out until it does
+        rows = [row for row in map(self._queue_samples.get, map(id, rabbit.all_queues)) if row is not None]
+        for column, (name, _, _) in enumerate(QUEUE_METRICS):
+            samples[name] = [row[column] for row in rows]
+
+        self.families = dict((name, ''.join(lines)) for name, lines in samples.items())
+
+    def _render_queue(self, queue):
+        labels = '%s,vhost="%s",queue="%s"' % (self._labels, _escape(queue.vhost), _escape(queue.name))
+        return tuple(_sample(name, labels, getattr(queue, attribute)) for name, _, attribute in QUEUE_METRICS)
+
+
+def exposition(cluster_metrics):
+    """ Return the text exposition of the samples of all clusters, grouped by metric.
+    """
+    parts = []
+    for name, help_text in FAMILIES.items():
+        parts.append('# HELP %s %s\n# TYPE %s gauge\n' % (name, help_text, name))
+        parts.extend(metrics.families.get(name, '') for metrics in cluster_metrics)
+    return ''.join(parts)
+
+
+def _sample(name, labels, value):
+    """ Return the sample line of value, an empty string when the value is not known.
+    """
+    if value is None or value == NOT_AVAILABLE:
+        return ''
+    if isinstance(value, bool):
+        value = int(value)
+    return '%s{%s} %s\n' % (name, labels, repr(value) if isinstance(value, float) else value)
+
+
+def _escape(value):
+    """ Return value as a utf-8 encoded label value.
+    """
+    value = (value or '').replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return value.encode('utf-8') if isinstance(value, unicode) else value
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        # A scraper that hangs up is not worth printing over the ui
+        _log.debug('Serving metrics to %s failed', client_address, exc_info=True)
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            return self._respond(404, 'text/plain', 'The metrics are at /metrics\n')
+        gzipped = 'gzip' in self.headers.get('Accept-Encoding', '')
+        self._respond(200, CONTENT_TYPE, self.server.exporter.body(gzipped), 'gzip' if gzipped else None)
+
+    def _respond(self, status, content_type, body, encoding=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        # Requests are not logged, the ui owns the terminal
+        pass
+
+
+class MetricsServer(object):
+    """ Serve the metrics of the clusters over http in the Prometheus text format.
+
+    The exposition is rendered in the poller threads after every refresh
+    and kept as one encoded buffer, a scrape only writes it out. Any number
+    of scrapers therefore adds no load on the management api and hardly any
+    on rabbittop. A gzipped copy is made for the first scrape that accepts it.
+    """
+
+    def __init__(self, clusters, port, host='127.0.0.1'):
+        self._metrics = []
+        for _cluster in clusters:
+            metrics = ClusterMetrics(_cluster.name)
+            _cluster.poller.add_listener(functools.partial(self._update, metrics, _cluster.rabbit))
+            self._metrics.append(metrics)
+        self._lock = threading.Lock()
+        self._body = exposition(self._metrics)
+        self._gzipped = None
+        self._server = _Server((host, port), _Handler)
+        self._server.exporter = self
+        self.host, self.port = self._server.server_address
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def body(self, gzipped=False):
+        with self._lock:
+            if not gzipped:
+                return self._body
+            if self._gzipped is None:
+                buf = io.BytesIO()
+                with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6) as gzip_file:
+                    gzip_file.write(self._body)
+                self._gzipped = buf.getvalue()
+            return self._gzipped
+
+    def _update(self, metrics, rabbit, snapshot):
+        metrics.update(rabbit, snapshot.changeset)
+        # Pollers of several clusters update concurrently, the last one to render has seen all of them
+        with self._lock:
+            self._body = exposition(self._metrics)
+            self._gzipped = None
@@ -0,0 +1,175 @@
+""" Background polling
+"""
+import collections
+import threading
+import time
+
+import logging
+
+from rabbittop._rabbitmq import SECTIONS
+
+_log = logging.getLogger()
+
+Snapshot = collections.namedtuple('Snapshot', ['generation', 'timestamp', 'duration', 'changeset'])
+
+# Default limits of the interval of an endpoint, in seconds
+MIN_INTERVAL = 1
+MAX_INTERVAL = 60
+
+# An endpoint is polled at most once per this many times its response time
+LATENCY_FACTOR = 10
+
+# Limit of the doublings of the interval after consecutive errors
+MAX_BACKOFF = 6
+
+
+class Schedule(object):
+    """ When to poll each endpoint of the api next.
+
+    Every endpoint is polled at the base interval, or at LATENCY_FACTOR
+    times its response time if that is longer, so a slow queue listing is
+    fetched less often than the cheap overview and the api is not loaded
+    harder when it is struggling. Consecutive errors double the interval of
+    an endpoint. Intervals stay between the floor and the ceiling.
+    """
+
+    def __init__(self, interval, floor=MIN_INTERVAL, ceiling=MAX_INTERVAL, endpoints=SECTIONS):
+        self.interval = interval
+        self.floor = floor
+        self.ceiling = ceiling
+        self._latency = dict.fromkeys(endpoints, 0.0)
+        self._errors = dict.fromkeys(endpoints, 0)
+        self._due = dict.fromkeys(endpoints, 0.0)
+
+    def interval_of(self, endpoint):
+        interval = max(self.interval, self._latency[endpoint] * LATENCY_FACTOR)
+        interval *= 2 ** min(self._errors[endpoint], MAX_BACKOFF)
+        return min(max(interval, self.floor), max(self.ceiling, self.floor))
+
+    def due(self, now):
+        """ Return the endpoints that should be polled at now.
+        """
+        return [endpoint for endpoint in self._due if self._due[endpoint] <= now]
+
+    def next_due(self):
+        return min(self._due.values())
+
+    def record(self, endpoint, duration, failed, polled_at):
+        """ Schedule the next poll of endpoint after one that took duration seconds.
+        """
+        if failed:
+            self._errors[endpoint] += 1
+        else:
+            self._errors[endpoint] = 0
+            # Back off at once when the api slows down, speed up again gradually
+            self._latency[endpoint] = max(duration, (self._latency[endpoint] + duration) / 2)
+        self._due[endpoint] = polled_at + self.interval_of(endpoint)
+
+    def reschedule(self, now):
+        """ Apply a changed base interval to the next polls.
+        """
+        for endpoint in self._due:
+            self._due[endpoint] = min(self._due[endpoint], now + self.interval_of(endpoint))
+
+    def force(self):
+        """ Make every endpoint due now.
+        """
+        for endpoint in self._due:
+            self._due[endpoint] = 0.0
+
+
+class Poller(object):
+    """ Refresh a Rabbit model in a background thread.
+
+    After every refresh a Snapshot is published in a shared slot, the UI
+    picks up the latest one with `latest()` whenever it likes, so slow API
+    calls never block key handling or drawing. A Schedule decides which
+    endpoints each refresh fetches. Listeners are called with every
+    Snapshot in the poller thread, while the model is not being updated.
+    """
+
+    def __init__(self, rabbit, interval, prepare=None, floor=MIN_INTERVAL, ceiling=MAX_INTERVAL):
+        self.rabbit = rabbit
+        self.schedule = Schedule(interval, floor, ceiling)
+        # Called before every refresh, a replay moves to the next frame here
+        self._prepare = prepare
+        self._snapshot = None
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    @property
+    def interval(self):
+        return self.schedule.interval
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def add_listener(self, callback):
+        """ Call callback(snapshot) after every refresh, add listeners before start().
+        """
+        self._listeners.append(callback)
+
+    def poll_now(self):
+        """ Start the next refresh of all endpoints without waiting for their intervals to pass.
+        """
+        with self._lock:
+            self.schedule.force()
+        self._wake.set()
+
+    def set_interval(self, interval):
+        with self._lock:
+            self.schedule.interval = interval
+            self.schedule.reschedule(time.time())
+        self._wake.set()
+
+    def intervals(self):
+        """ Return the current interval of each endpoint.
+        """
+        with self._lock:
+            return collections.OrderedDict((endpoint, self.schedule.interval_of(endpoint)) for endpoint in SECTIONS)
+
+    def latest(self):
+        """ Return the Snapshot of the last finished refresh, None before the first one.
+        """
+        with self._lock:
+            return self._snapshot
+
+    def _run(self):
+        generation = 0
+        while not self._stopped.is_set():
+            started = time.time()
+            with self._lock:
+                sections = self.schedule.due(started)
+            if sections:
+                changeset = None
+                try:
+                    if self._prepare:
+                        self._prepare()
+                    changeset = self.rabbit.refresh(sections)
+                except Exception:
+                    _log.debug('Refresh failed', exc_info=True)
+
+                generation += 1
+                with self._lock:
+                    for section in sections:
+                        self.schedule.record(section, self.rabbit.durations.get(section, time.time() - started),
+                                             changeset is None or section in self.rabbit.errors, started)
+                    self._snapshot = snapshot = Snapshot(generation, time.time(), time.time() - started, changeset)
+                for listener in self._listeners:
+                    try:
+                        listener(snapshot)
+                    except Exception:
+                        _log.debug('Listener failed', exc_info=True)
+
+            with self._lock:
+                next_due = self.schedule.next_due()
+            self._wake.wait(max(next_due - time.time(), 0))
+            self._wake.clear()
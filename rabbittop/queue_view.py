@@ -0,0 +1,250 @@
+""" Filtering and sorting of the queue list
+"""
+import bisect
+import collections
+import operator
+import re
+import threading
+
+# Queue attributes the list can be sorted by, with whether they are numbers
+SORT_COLUMNS = collections.OrderedDict([
+    ('name', False),
+    ('vhost', False),
+    ('state', False),
+    ('policy', False),
+    ('ready', True),
+    ('unacked', True),
+    ('total', True),
+    ('total_rate', True),
+    ('ready_rate', True),
+    ('unacked_rate', True),
+])
+
+# Sort fields of the management api (3.6+ paging) for the sort columns
+API_SORT_FIELDS = {
+    'name': 'name',
+    'vhost': 'vhost',
+    'state': 'state',
+    'policy': 'policy',
+    'ready': 'messages_ready',
+    'unacked': 'messages_unacknowledged',
+    'total': 'messages',
+    'total_rate': 'messages_details.rate',
+    'ready_rate': 'messages_ready_details.rate',
+    'unacked_rate': 'messages_unacknowledged_details.rate',
+}
+
+FILTER_FIELDS = ('name', 'vhost', 'policy', 'state')
+
+_regex_characters = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
+# Above this share of changed queues a sort index is sorted again instead of updated queue by queue
+_REBUILD_SHARE = 32
+
+_MISSING = float('-inf')
+
+
+class Filter(object):
+    """ A queue filter as typed by the user.
+
+    The text holds space separated terms that all have to match. A term is a
+    regular expression searched in the queue name, or field:expression for
+    the name, vhost, policy or state. A term that is not a valid expression
+    (yet, while it is typed) is matched literally. With `active` idle queues
+    are left out as well.
+    """
+
+    def __init__(self, text='', active=False):
+        self.text = text
+        self.active = active
+        self.terms = []
+        for term in text.split():
+            field, separator, pattern = term.partition(':')
+            if not separator or field not in FILTER_FIELDS:
+                field, pattern = 'name', term
+            if not pattern:
+                continue
+            try:
+                regex = re.compile(pattern)
+            except re.error:
+                regex = re.compile(re.escape(pattern))
+            self.terms.append((field, pattern, regex))
+
+    def __nonzero__(self):
+        return bool(self.terms) or self.active
+
+    @property
+    def name_pattern(self):
+        """ The expression of the first name term, for filtering on the server.
+        """
+        for field, pattern, _ in self.terms:
+            if field == 'name':
+                return pattern
+        return None
+
+    @property
+    def local(self):
+        """ True when the filter has terms the server can not apply, all but the first name term and active.
+        """
+        return self.active or len(self.terms) > (0 if self.name_pattern is None else 1)
+
+    def apply(self, queues):
+        """ Return the queues that match, in the same order.
+        """
+        if self.active:
+            queues = [queue for queue in queues if queue.state != 'idle']
+        for field, _, regex in self.terms:
+            search = regex.search
+            value = operator.attrgetter(field)
+            queues = [queue for queue in queues if search(value(queue) or '')]
+        return queues if isinstance(queues, list) else list(queues)
+
+    def narrows(self, other):
+        """ True when every queue that matches this filter matches other as well.
+
+        That is the case while a term is being typed, so the queues matching
+        the previous text only have to be filtered further.
+        """
+        if other.active and not self.active:
+            return False
+        for field, pattern, _ in other.terms:
+            if not any(_field == field and (_pattern == pattern or _literal_in(pattern, _pattern))
+                       for _field, _pattern, _ in self.terms):
+                return False
+        return True
+
+
+def _literal_in(pattern, other):
+    return not _regex_characters.search(pattern + other) and pattern in other
+
+
+class SortIndex(object):
+    """ The queues ordered by one attribute.
+
+    Changesets of the refreshes are queued and applied when the order is
+    asked for, so indexes of columns that are not shown cost nothing: a
+    changed queue is moved with a bisect, and only when a large share of
+    the queues changed are they sorted again. The values the queues are
+    indexed by are kept, so a queue can be found in the index after it
+    changed in place. Entries are (value, id, queue) tuples, the id of the
+    queue object breaks ties cheaply.
+    """
+
+    def __init__(self, attribute, queues):
+        self.attribute = attribute
+        self._numeric = SORT_COLUMNS[attribute]
+        self._getter = operator.attrgetter(attribute)
+        self._values = {}
+        self._entries = []
+        # Changesets not applied yet, None when sorting again is cheaper
+        self._pending = []
+        self._ordered = {}
+        self._rebuild(queues)
+
+    def update(self, changeset):
+        if self._pending is not None:
+            self._pending.append(changeset)
+            changes = sum(len(_changeset.added) + len(_changeset.removed) + len(_changeset.changed)
+                          for _changeset in self._pending)
+            if changes * _REBUILD_SHARE > len(self._entries):
+                self._pending = None
+        self._ordered = {}
+
+    def queues(self, queues, reverse=False):
+        """ Return the queues in order, queues is the current listing in case they have to be sorted again.
+        """
+        if self._pending is None:
+            self._rebuild(queues)
+        elif self._pending:
+            for changeset in self._pending:
+                self._apply(changeset)
+            self._pending = []
+
+        ordered = self._ordered.get(reverse)
+        if ordered is None:
+            entries = reversed(self._entries) if reverse else self._entries
+            ordered = self._ordered[reverse] = [queue for _, _, queue in entries]
+        return ordered
+
+    def _rebuild(self, queues):
+        values = [self._value(value) for value in map(self._getter, queues)]
+        idents = map(id, queues)
+        self._values = dict(zip(idents, values))
+        self._entries = zip(values, idents, queues)
+        self._entries.sort()
+        self._pending = []
+
+    def _apply(self, changeset):
+        for queue in changeset.removed:
+            self._remove(queue)
+        for queue in changeset.added + changeset.changed:
+            value = self._value(self._getter(queue))
+            if self._values.get(id(queue)) == value:
+                continue
+            self._remove(queue)
+            bisect.insort(self._entries, (value, id(queue), queue))
+            self._values[id(queue)] = value
+
+    def _remove(self, queue):
+        value = self._values.pop(id(queue), None)
+        if value is None:
+            return
+        position = bisect.bisect_left(self._entries, (value, id(queue)))
+        if position < len(self._entries) and self._entries[position][2] is queue:
+            del self._entries[position]
+
+    def _value(self, value):
+        if self._numeric:
+            # Unknown values (N/A) sort below all numbers
+            return value if isinstance(value, (int, long, float)) else _MISSING
+        return value or u''
+
+
+class QueueView(object):
+    """ The queues in the order and with the filter chosen in the ui.
+
+    Sort indexes are created the first time a column is sorted by and are
+    maintained from the Changesets after that. The last result is cached,
+    so drawing does not filter again, and when the filter only got
+    narrower (a term being typed) the previous result is filtered instead
+    of all queues.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self._version = 0
+        self._cache_key = None
+        self._filter = Filter()
+        self._result = []
+
+    def update(self, changeset):
+        """ Queue the Changeset of a refresh for the sort indexes.
+        """
+        with self._lock:
+            for index in self._indexes.values():
+                index.update(changeset)
+            self._version += 1
+
+    def queues(self, queues, sort=None, reverse=False, _filter=None):
+        """ Return the queues of the listing that match the filter, in sort order.
+        """
+        _filter = _filter or Filter()
+        with self._lock:
+            cache_key = (self._version, sort, reverse)
+            if cache_key == self._cache_key and _filter.narrows(self._filter):
+                if _filter.text == self._filter.text and _filter.active == self._filter.active:
+                    return self._result
+                source = self._result
+            elif sort:
+                index = self._indexes.get(sort)
+                if index is None:
+                    index = self._indexes[sort] = SortIndex(sort, queues)
+                source = index.queues(queues, reverse)
+            else:
+                source = queues[::-1] if reverse else queues
+
+            self._result = _filter.apply(source)
+            self._cache_key = cache_key
+            self._filter = _filter
+            return self._result
@@ -0,0 +1,306 @@
+""" Recording and replay of cluster snapshots
+"""
+import bisect
+import collections
+import json
+import struct
+import threading
+import time
+import zlib
+
+from rabbittop import _rabbitmq
+
+MAGIC = 'RABBITTOP-RECORDING 1\n'
+
+KEYFRAME = 1
+DELTA = 2
+
+# Frame header: kind, timestamp, length of the compressed payload
+_header = struct.Struct('>BdI')
+
+# Index entry in the FILE.idx sidecar: timestamp and file offset of a keyframe
+_index_entry = struct.Struct('>dQ')
+
+# A full snapshot is written every this many frames
+KEYFRAME_INTERVAL = 100
+
+
+class Recorder(object):
+    """ Append snapshots of a cluster to a recording file.
+
+    Every frame is a header followed by a zlib compressed json payload.
+    Keyframes hold the complete overview, nodes and queues; the frames in
+    between only hold the sections and queues that changed since the
+    previous frame and the queues that were deleted, so an unchanged queue
+    costs nothing. Changes are detected with a crc32 per queue instead of
+    keeping the previous queue documents in memory. A keyframe that is due
+    while a section could not be fetched is postponed to the next complete
+    snapshot. The offset of every keyframe is appended to the FILE.idx
+    sidecar for seeking.
+    """
+
+    def __init__(self, path, keyframe_interval=KEYFRAME_INTERVAL):
+        self._file = open(path, 'ab')
+        self._file.seek(0, 2)
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self._index = open(path + '.idx', 'ab')
+        self._keyframe_interval = keyframe_interval
+        # Frames since the last keyframe, a keyframe is due from the interval on
+        self._frames = keyframe_interval
+        self._fingerprints = {}
+        self._queue_fingerprints = {}
+
+    def write(self, timestamp, overview, nodes, queues):
+        """ Append a snapshot, a section that is None could not be fetched.
+
+        `queues` may be any iterable of queue documents, e.g. a JSONStream.
+        Returns the number of bytes written.
+        """
+        keyframe = self._frames >= self._keyframe_interval and None not in (overview, nodes, queues)
+        payload = {}
+        # The fingerprints are only kept once the frame is written, reading the queues may still fail
+        fingerprints = {}
+        for name, section in (('overview', overview), ('nodes', nodes)):
+            if section is not None:
+                fingerprints[name] = _fingerprint(section)
+                if keyframe or self._fingerprints.get(name) != fingerprints[name]:
+                    payload[name] = section
+
+        queue_fingerprints = self._queue_fingerprints
+        if queues is not None:
+            changed = []
+            queue_fingerprints = {}
+            for queue in queues:
+                key = (queue.get('vhost'), queue.get('name'))
+                fingerprint = _fingerprint(queue)
+                if keyframe or self._queue_fingerprints.get(key) != fingerprint:
+                    changed.append(queue)
+                queue_fingerprints[key] = fingerprint
+            if keyframe:
+                payload['queues'] = changed
+            else:
+                payload['queues'] = {
+                    'set': changed,
+                    'del': [list(key) for key in self._queue_fingerprints if key not in queue_fingerprints],
+                }
+
+        data = zlib.compress(json.dumps(payload, separators=(',', ':')))
+        if keyframe:
+            self._index.write(_index_entry.pack(timestamp, self._file.tell()))
+            self._index.flush()
+        self._file.write(_header.pack(KEYFRAME if keyframe else DELTA, timestamp, len(data)))
+        self._file.write(data)
+        self._file.flush()
+        self._fingerprints.update(fingerprints)
+        self._queue_fingerprints = queue_fingerprints
+        self._frames = 1 if keyframe else self._frames + 1
+        return _header.size + len(data)
+
+    def close(self):
+        self._file.close()
+        self._index.close()
+
+
+class Player(object):
+    """ Serve a recording to a Rabbit model in place of a Client.
+
+    The playback position runs with the wall clock times the speed. Before
+    every refresh the poller calls `sync()`, which applies the frames up to
+    the position; the requests of the refresh are then answered from that
+    state. Seeking starts from the last keyframe before the target, found
+    in the index, so it does not read the recording from the start.
+    """
+
+    def __init__(self, path, speed=1.0):
+        self._file = open(path, 'rb')
+        if self._file.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{0} is not a rabbittop recording'.format(path))
+        self._lock = threading.Lock()
+        self._keyframes = _load_index(path + '.idx')
+        self._scan()
+
+        self.speed = speed
+        self.paused = False
+        self.frame_time = None
+        self._overview = None
+        self._nodes = None
+        self._queues = collections.OrderedDict()
+        self._seek_frame(self.start)
+        self._anchor = (self.start, time.time())
+
+    def time(self):
+        """ The playback position as a timestamp of the recording.
+        """
+        position, wall_time = self._anchor
+        if not self.paused:
+            position += (time.time() - wall_time) * self.speed
+        return min(max(position, self.start), self.end)
+
+    def sync(self):
+        """ Apply the frames up to the playback position.
+        """
+        with self._lock:
+            position = self.time()
+            if self.frame_time is None or position < self.frame_time or self._keyframe_between(position):
+                self._seek_frame(position)
+            else:
+                self._read_until(position)
+
+    def _keyframe_between(self, timestamp):
+        """ Whether an indexed keyframe lies after the current frame up to timestamp, skipping there is cheaper.
+        """
+        index = bisect.bisect_right(self._keyframes, (timestamp, float('inf'))) - 1
+        return index >= 0 and self._keyframes[index][0] > self.frame_time
+
+    def seek(self, timestamp):
+        with self._lock:
+            self._anchor = (min(max(timestamp, self.start), self.end), time.time())
+
+    def skip(self, seconds):
+        self.seek(self.time() + seconds)
+
+    def set_speed(self, speed):
+        self._anchor = (self.time(), time.time())
+        self.speed = speed
+
+    def pause(self):
+        """ Toggle between paused and playing.
+        """
+        self._anchor = (self.time(), time.time())
+        self.paused = not self.paused
+
+    def request(self, path, data=None, method='GET', host=None):
+        resource = path.split('?')[0]
+        if resource == 'overview' and self._overview is not None:
+            return self._overview
+        if resource == 'nodes' and self._nodes is not None:
+            return self._nodes
+        raise _rabbitmq.APIError(404, 'Not recorded', path)
+
+    def stream(self, path, items_key='items', host=None):
+        if not path.startswith('queues/'):
+            raise _rabbitmq.APIError(404, 'Not recorded', path)
+        return list(self._queues.itervalues())
+
+    def close(self):
+        self._file.close()
+
+    def _scan(self):
+        """ Find the start, the keyframes after the last indexed one and the end of the recording.
+
+        Keyframes wait for a complete snapshot, so the recording may start
+        with deltas or have no keyframe at all.
+        """
+        self._file.seek(len(MAGIC))
+        header = self._read_header()
+        self.start = header[1] if header else 0.0
+        self._file.seek(self._keyframes[-1][1] if self._keyframes else len(MAGIC))
+        self.end = self.start
+        while True:
+            offset = self._file.tell()
+            header = self._read_header()
+            if header is None:
+                break
+            kind, timestamp, length = header
+            if kind == KEYFRAME and (not self._keyframes or offset > self._keyframes[-1][1]):
+                self._keyframes.append((timestamp, offset))
+            self.end = timestamp
+            self._file.seek(length, 1)
+
+    def _seek_frame(self, timestamp):
+        """ Load the last keyframe before timestamp and apply the frames after it.
+        """
+        index = bisect.bisect_right(self._keyframes, (timestamp, float('inf'))) - 1
+        self._file.seek(self._keyframes[index][1] if index >= 0 else len(MAGIC))
+        self.frame_time = None
+        if index < 0:
+            # Only deltas come before the first keyframe, they are applied to nothing
+            self._overview = self._nodes = None
+            self._queues = collections.OrderedDict()
+        self._read_until(timestamp)
+
+    def _read_until(self, timestamp):
+        while True:
+            offset = self._file.tell()
+            header = self._read_header()
+            if header is None:
+                return
+            kind, frame_time, length = header
+            data = self._file.read(length)
+            if len(data) < length:
+                self._file.seek(offset)
+                return
+            # A recording that is still being written grows while it is played
+            self.end = max(self.end, frame_time)
+            if frame_time > timestamp and self.frame_time is not None:
+                self._file.seek(offset)
+                return
+            self._apply(kind, json.loads(zlib.decompress(data)))
+            self.frame_time = frame_time
+
+    def _read_header(self):
+        offset = self._file.tell()
+        header = self._file.read(_header.size)
+        if len(header) < _header.size:
+            # End of the recording, or a frame that is still being written
+            self._file.seek(offset)
+            return None
+        return _header.unpack(header)
+
+    def _apply(self, kind, payload):
+        # A keyframe replaces the sections it holds, older recordings have keyframes without every section
+        if kind == KEYFRAME and 'queues' in payload:
+            self._queues = collections.OrderedDict()
+        if 'overview' in payload:
+            self._overview = payload['overview']
+        if 'nodes' in payload:
+            self._nodes = payload['nodes']
+        queues = payload.get('queues')
+        if isinstance(queues, dict):
+            for key in queues['del']:
+                self._queues.pop(tuple(key), None)
+            queues = queues['set']
+        for queue in queues or ():
+            self._queues[(queue.get('vhost'), queue.get('name'))] = queue
+
+
+def _load_index(path):
+    """ Read the keyframes (timestamp, offset) from an index sidecar, it may be missing.
+    """
+    try:
+        with open(path, 'rb') as index_file:
+            data = index_file.read()
+    except IOError:
+        return []
+    return [_index_entry.unpack_from(data, offset)
+            for offset in range(0, len(data) - len(data) % _index_entry.size, _index_entry.size)]
+
+
+def _fingerprint(value):
+    return zlib.crc32(json.dumps(value, sort_keys=True, separators=(',', ':')))
+
+
+def record(client, path, interval, vhost='', timeout=None):
+    """ Poll the cluster every interval seconds and append the snapshots to path until interrupted.
+    """
+    recorder = Recorder(path)
+    try:
+        while True:
+            started = time.time()
+            results = _rabbitmq.fetch_concurrently({
+                'overview': (_rabbitmq.overview, (client,)),
+                'nodes': (_rabbitmq.status, (client,)),
+            }, timeout=timeout)
+            try:
+                queues = _rabbitmq.list_queues(client, vhost, columns=_rabbitmq.QUEUE_COLUMNS, stream=True)
+                size = recorder.write(started, results['overview'], results['nodes'], queues)
+            except Exception as error:
+                size = recorder.write(started, results['overview'], results['nodes'], None)
+                print('%s queues unavailable: %s' % (time.strftime('%H:%M:%S'), error))
+            print('%s recorded %d bytes in %.2fs' % (time.strftime('%H:%M:%S'), size, time.time() - started))
+            time.sleep(max(interval - (time.time() - started), 0))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        recorder.close()
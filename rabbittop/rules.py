@@ -0,0 +1,320 @@
+""" Thresholds of the node, message and queue stats and the alerts they raise
+"""
+import ConfigParser
+import array
+import bisect
+import collections
+import itertools
+import operator
+import subprocess
+import threading
+
+import logging
+
+from rabbittop import queue_view
+from rabbittop._rabbitmq import NOT_AVAILABLE
+
+_log = logging.getLogger()
+
+OK, WARNING, ERROR = 0, 1, 2
+LEVELS = ('ok', 'warning', 'error')
+
+# Color of a stat and of a queue row per severity
+STAT_COLORS = ('OK', 'CRITICAL', 'CRITICAL_LOG')
+ROW_COLORS = ('NICE', 'CRITICAL', 'CRITICAL_LOG')
+
+# Node metrics as a percentage of one Node attribute of another
+NODE_METRICS = collections.OrderedDict([
+    ('memory', ('mem_used', 'mem_limit')),
+    ('disk', ('disk_free_limit', 'disk_free')),
+    ('processes', ('proc_used', 'proc_totoal')),
+    ('sockets', ('sockets_used', 'sockets_total')),
+])
+
+# Keys of Rabbit.messages, their counts are compared
+MESSAGE_METRICS = ('total', 'ready', 'unacknowledged')
+
+# The numeric RabbitQueue attributes
+QUEUE_METRICS = tuple(column for column, numeric in queue_view.SORT_COLUMNS.items() if numeric)
+
+# Warning and error thresholds by section and metric, a rules file overrides them per metric
+DEFAULTS = collections.OrderedDict([
+    ('node', {'memory': (75, 95), 'disk': (75, 95), 'processes': (75, 95), 'sockets': (75, 95)}),
+    ('messages', {'ready': (10, 15), 'unacknowledged': (10, 15)}),
+    ('queues', {'ready': (1000, 10000), 'unacked': (1000, 10000)}),
+])
+
+# The queue attributes a filter can match, a rule set is matched once per combination of them
+_filter_fields = operator.attrgetter(*queue_view.FILTER_FIELDS)
+_Fields = collections.namedtuple('_Fields', queue_view.FILTER_FIELDS)
+
+
+_METRICS = {'node': tuple(NODE_METRICS), 'messages': MESSAGE_METRICS, 'queues': QUEUE_METRICS}
+
+# Bounds of a queue rule set without thresholds for a metric that other rule sets have, no number reaches them
+_NO_BOUNDS = (float('inf'), float('inf'))
+
+# Queue fields that change while a queue exists, a filter on them has to match a queue again when they changed
+_CHANGING_FIELDS = ('policy', 'state')
+_slot = operator.attrgetter('slot')
+
+# Combinations of filter fields the rule set is remembered of, queues come and go
+_MAX_MATCHED = 500000
+
+
+class Rules(object):
+    """ Warning and error thresholds of the stats.
+
+    A stat is a warning from its warning threshold on and an error from its
+    error threshold on. Node metrics are percentages, messages and queues
+    are compared as they are. Queues have thresholds for all queues and
+    for the queues matching a filter (the syntax of the queue filter), the
+    first matching filter overrides the thresholds it sets.
+
+    Thresholds are kept as sorted bounds, a severity is the number of
+    bounds a value reaches. A stat that is not a number, or has no
+    thresholds, is ok.
+
+    Queues are evaluated from the arrays of their latest metrics (see
+    Rabbit.queue_columns) by slot, with the index of the rule set each
+    queue matched, which only has to be looked up again when a filter
+    matches on a field that changed (see `rematch`).
+    """
+
+    def __init__(self, thresholds=None, queue_filters=()):
+        self.thresholds = dict((section, dict(metrics)) for section, metrics in DEFAULTS.items())
+        for section, metrics in (thresholds or {}).items():
+            self.thresholds[section].update(metrics)
+        # (Filter, thresholds) of the queues matching a filter, the thresholds of all queues merged in
+        self.queue_filters = [(_filter, dict(self.thresholds['queues'], **metrics)) for _filter, metrics in queue_filters]
+        # The warning and the error bounds by metric, per queue rule set: all queues first, then one per filter
+        rule_sets = [self.thresholds['queues']] + [metrics for _, metrics in self.queue_filters]
+        self._queue_bounds = dict(
+            (metric, zip(*[_bounds(metrics[metric]) if metric in metrics else _NO_BOUNDS for metrics in rule_sets]))
+            for metric in QUEUE_METRICS
+            if any(metric in metrics for metrics in rule_sets))
+        self._rule_sets = _RuleSets(self.queue_filters)
+        # Whether a changed queue may match another rule set
+        self.rematch = any(field in _CHANGING_FIELDS or _filter.active
+                           for _filter, _ in self.queue_filters for field, _, _ in _filter.terms)
+
+    def severity(self, section, metric, value):
+        """ Return the severity of value for metric of the node or messages section.
+        """
+        thresholds = self.thresholds[section].get(metric)
+        if thresholds is None or not isinstance(value, (int, long, float)):
+            return OK
+        return bisect.bisect_right(_bounds(thresholds), value)
+
+    def node_severity(self, node, metric):
+        part, whole = (getattr(node, attribute) for attribute in NODE_METRICS[metric])
+        return self.severity('node', metric, _percent(part, whole))
+
+    def match(self, queues):
+        """ Return the index of the rule set of every queue: 0 for all queues, 1 and on for the filters.
+        """
+        if not self.queue_filters:
+            return [0] * len(queues)
+        return map(self._rule_sets.__getitem__, map(_filter_fields, queues))
+
+    def evaluate(self, columns, slots, rule_sets):
+        """ Return the severity of the queues in slots as an array of bytes, in the order of slots.
+
+        `columns` are the arrays of the queue metrics by name and
+        `rule_sets` the index of the rule set of every queue (see match).
+        Every metric with thresholds is compared with the warning bounds
+        in one C loop over its column, only the queues that reached them
+        are compared with the error bounds.
+        """
+        severities = array.array('b', [OK]) * len(slots)
+        for metric, (warnings, errors) in self._queue_bounds.items():
+            values = map(columns[metric].__getitem__, slots)
+            if self.queue_filters:
+                reached = map(operator.le, map(warnings.__getitem__, rule_sets), values)
+            else:
+                # The bounds and the values are floats, so their own comparison can be used
+                reached = map(warnings[0].__le__, values)
+            for position in itertools.compress(xrange(len(slots)), reached):
+                error = errors[rule_sets[position]] if self.queue_filters else errors[0]
+                severity = ERROR if values[position] >= error else WARNING
+                if severity > severities[position]:
+                    severities[position] = severity
+        return severities
+
+
+class _RuleSets(dict):
+    """ The index of the rule set of a queue by the values of its _filter_fields.
+    """
+
+    def __init__(self, queue_filters):
+        super(_RuleSets, self).__init__()
+        self._filters = [_filter for _filter, _ in queue_filters]
+
+    def __missing__(self, key):
+        if len(self) >= _MAX_MATCHED:
+            self.clear()
+        queue = _Fields(*key)
+        for index, _filter in enumerate(self._filters):
+            if _filter.apply([queue]):
+                break
+        else:
+            index = -1
+        self[key] = index + 1
+        return index + 1
+
+
+def _bounds(thresholds):
+    warning, error = thresholds
+    return (float(warning), float(max(warning, error)))
+
+
+def _percent(part, whole):
+    if not isinstance(part, (int, long, float)) or not isinstance(whole, (int, long, float)) or not whole:
+        return NOT_AVAILABLE
+    return float(part) / whole * 100
+
+
+def load(path):
+    """ Read Rules from an ini style file.
+
+    The node, messages and queues sections set thresholds as `metric =
+    warning error`, sections named `queues FILTER` set them for the queues
+    matching the filter.
+    """
+    parser = ConfigParser.RawConfigParser()
+    parser.optionxform = str
+    with open(path) as rules_file:
+        parser.readfp(rules_file)
+
+    thresholds = {}
+    queue_filters = []
+    for name in parser.sections():
+        section, _, text = name.partition(' ')
+        if section not in _METRICS or (text and section != 'queues'):
+            raise ValueError('%s: unknown section [%s]' % (path, name))
+        metrics = {}
+        for metric, value in parser.items(name):
+            if metric not in _METRICS[section]:
+                raise ValueError('%s: unknown metric %s in [%s], known are %s' % (
+                    path, metric, name, ', '.join(_METRICS[section])))
+            try:
+                warning, error = map(float, value.replace(',', ' ').split())
+            except ValueError:
+                raise ValueError('%s: %s in [%s] should be a warning and an error threshold' % (path, metric, name))
+            metrics[metric] = (warning, error)
+        if text:
+            queue_filters.append((queue_view.Filter(text.strip()), metrics))
+        else:
+            thresholds.setdefault(section, {}).update(metrics)
+    return Rules(thresholds, queue_filters)
+
+
+class Alerts(object):
+    """ The severities of the queues of a cluster, kept up to date from the Changesets of the refreshes.
+
+    Only the queues that were added or changed are evaluated, in one batch
+    over the columns of their metrics, and compared with their previous
+    severities in C loops, so a refresh costs in proportion to what
+    changed. The rule set a queue matched is kept by its slot, it is looked
+    up when the queue is added and, when Rules.rematch, again when its
+    policy or state changed. The severities of the queues that are not ok
+    are kept by the id of the queue object for drawing. The hook, when
+    given, is called with the (severity, vhost, name) of the queues whose
+    severity changed, a removed queue is ok.
+    """
+
+    def __init__(self, rules, hook=None):
+        self.rules = rules
+        self._hook = hook
+        # Severity of the queues that are not ok, by the id of the queue object
+        self._flagged = {}
+        # The index of the rule set of every queue by its slot, and the _CHANGING_FIELDS it was matched with
+        self._rule_sets = array.array('H')
+        self._matched_fields = dict((field, []) for field in _CHANGING_FIELDS)
+        # The number of queues per severity
+        self.counts = [0, 0, 0]
+
+    def severity(self, queue):
+        return self._flagged.get(id(queue), OK)
+
+    def update(self, rabbit, snapshot):
+        changeset = snapshot.changeset
+        if changeset is None:
+            return
+        flagged = self._flagged
+        changes = []
+        for queue in changeset.removed:
+            if flagged.pop(id(queue), OK) != OK:
+                changes.append((OK, queue.vhost, queue.name))
+
+        # Queues of an earlier Changeset of the batch may have been removed since
+        added = [queue for queue in changeset.added if queue.slot is not None]
+        changed = [queue for queue in changeset.changed if queue.slot is not None]
+        queues = added + changed
+        slots = map(_slot, queues)
+        if self.rules.queue_filters:
+            rule_sets = self._match(added, changed, max(slots) if slots else -1)
+            severities = self.rules.evaluate(rabbit.queue_columns, slots, map(rule_sets.__getitem__, slots))
+        else:
+            severities = self.rules.evaluate(rabbit.queue_columns, slots, None)
+        previous = map(flagged.get, map(id, queues), itertools.repeat(OK, len(queues)))
+        for index in itertools.compress(xrange(len(queues)), map(operator.ne, previous, severities)):
+            queue, severity = queues[index], severities[index]
+            if severity == OK:
+                del flagged[id(queue)]
+            else:
+                flagged[id(queue)] = severity
+            changes.append((severity, queue.vhost, queue.name))
+
+        if changes or changeset.added or changeset.removed:
+            severities = flagged.values()
+            warnings, errors = severities.count(WARNING), severities.count(ERROR)
+            self.counts = [len(rabbit.all_queues) - warnings - errors, warnings, errors]
+        if changes and self._hook:
+            self._hook(sorted(changes, reverse=True))
+
+    def _match(self, added, changed, last_slot):
+        """ Store the rule set of the queues that need one by their slot, return the rule sets of all slots.
+        """
+        rule_sets = self._rule_sets
+        if last_slot >= len(rule_sets):
+            rule_sets.extend(itertools.repeat(0, last_slot + 1 - len(rule_sets)))
+            for values in self._matched_fields.values():
+                values.extend(itertools.repeat(None, last_slot + 1 - len(values)))
+        queues = added
+        if self.rules.rematch:
+            # The fields are compared one at a time, a tuple per queue would cost more than matching
+            slots = map(_slot, changed)
+            moved = [False] * len(changed)
+            for field, values in self._matched_fields.items():
+                moved = map(operator.or_, moved, map(operator.ne, map(operator.attrgetter(field), changed),
+                                                     map(values.__getitem__, slots)))
+            queues = added + list(itertools.compress(changed, moved))
+        for queue, index in itertools.izip(queues, self.rules.match(queues)):
+            rule_sets[queue.slot] = index
+            for field, values in self._matched_fields.items():
+                values[queue.slot] = getattr(queue, field)
+        return rule_sets
+
+
+def command_hook(command, cluster_name):
+    """ Return an Alerts hook that runs command in a shell with a line per change on its stdin.
+
+    The lines read `severity cluster vhost queue`, the command runs in a
+    thread of its own so a slow one does not hold up polling.
+    """
+    def _hook(changes):
+        lines = ''.join('%s %s %s %s\n' % (LEVELS[severity], cluster_name, vhost, name)
+                        for severity, vhost, name in changes)
+        thread = threading.Thread(target=_run_command, args=(command, lines.encode('utf-8')))
+        thread.daemon = True
+        thread.start()
+    return _hook
+
+
+def _run_command(command, text):
+    try:
+        process = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE, close_fds=True)
+        process.communicate(text)
+    except (OSError, IOError):
+        _log.debug('Alert command %s failed', command, exc_info=True)
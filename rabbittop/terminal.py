@@ -25,6 +25,63 @@ SOFTWARE.
 import curses
 
 
+class Frame(object):
+    """ Lines written to a curses window in the current and the previous frame.
+
+    Lines are collected per row and only rows whose text or colors differ
+    from the previous frame are written to the window, rows that are no
+    longer used are cleared. curses then only sends the changed cells to the
+    terminal on the next doupdate.
+    """
+
+    def __init__(self, window):
+        self._window = window
+        self._previous = {}
+        self._current = {}
+        self.rows_written = 0
+
+    def add_line(self, text, top, left, color=None):
+        self._current.setdefault(top, []).append((left, text, color))
+
+    def flush(self):
+        rows_written = 0
+        height, width = self._window.getmaxyx()
+        for top, lines in self._current.items():
+            if top >= height:
+                continue
+            if self._previous.get(top) != lines:
+                self._window.move(top, 0)
+                self._window.clrtoeol()
+                for left, text, color in lines:
+                    self._write(top, left, text, color, width)
+                rows_written += 1
+        for top in self._previous:
+            if top not in self._current:
+                self._window.move(top, 0)
+                self._window.clrtoeol()
+                rows_written += 1
+        self._previous, self._current = self._current, {}
+        self.rows_written = rows_written
+
+    def _write(self, top, left, text, color, width):
+        """ Write text without wrapping it onto the next row.
+        """
+        if left >= width:
+            return
+        # Expand tabs to the tab stops of the row before cutting the text at the window edge
+        text = (' ' * left + text).expandtabs()[left:width]
+        try:
+            self._window.addstr(top, left, text, color)
+        except curses.error:
+            # Writing the bottom right cell moves the cursor off the window
+            pass
+
+    def invalidate(self):
+        """ Rewrite every row on the next flush, e.g. after the window was cleared.
+        """
+        self._previous = {}
+
+
 class Terminal(object):
 
     def __init__(self, scrn=None):
@@ -35,10 +92,9 @@ class Terminal(object):
 #        curses.curs_set(0)
         self._screen.keypad(1)
 
-        self._refresh_rate = 3
-        self._screen.timeout(self._refresh_rate * 1000)
-        self.selected_row = None
-        self.start_row = 0
+        # Milliseconds getch waits for a key, keeps the ui responsive while data is fetched
+        self._input_timeout = 100
+        self._screen.timeout(self._input_timeout)
 
         curses.start_color()
         curses.init_pair(1, curses.COLOR_WHITE, curses.COLOR_BLACK)
@@ -74,107 +130,88 @@ class Terminal(object):
             'REVERSE': curses.color_pair(11),
         }
 
-        self._panels = {}
-        self._windows = {}
+        self._frame = Frame(self._screen)
+        self._views = {}
 
     @property
     def colors(self):
         return self._colors_list
 
     @property
-    def panels(self):
-        return self._panels
-
-    @property
-    def windows(self):
-        return self._windows
+    def views(self):
+        return self._views
 
     def getch(self):
         return self._screen.getch()
 
     def refresh(self):
-        return self._screen.refresh()
+        """ Write the changed rows of this frame and update the terminal once.
+        """
+        self._frame.flush()
+        self._screen.noutrefresh()
+        curses.doupdate()
 
     def get_size(self):
         return self._screen.getmaxyx()
 
+    def resized(self):
+        """ Clear the screen and write every row on the next refresh, rows were cut at the previous width.
+        """
+        self._screen.clear()
+        self._frame.invalidate()
+
     def stop(self):
         curses.nocbreak()
         self._screen.keypad(0)
         curses.echo()
         curses.endwin()
 
-    def create_window(self, name, height, width, top, left):
-        panel = Window(height, width, top, left, self)
-        self._windows[name] = panel
-        return panel
-
-    def create_panel(self, name, height, width):
-        panel = Panel(height, width)
-        self._panels[name] = panel
-        return panel
+    def create_view(self, name):
+        view = ListView(self)
+        self._views[name] = view
+        return view
 
     def add_line(self, text, top, left, color=None):
-        self._screen.addstr(top, left, text, color)
-
-    def up(self):
-        self.selected_row -= 1
-
-    def down(self):
-        self.selected_row += 1
-
+        self._frame.add_line(text, top, left, color)
 
-class Window(object):
 
-    def __init__(self, height, width, top, left, parent):
-        self._panel = parent._screen.subwin(height, width, top, left)
-        self._parent = parent
-        self._panel.scrollok(1)
-        self._panel.idlok(1)
-        self._panel.touchwin()
+class ListView(object):
+    """ Scrollable list that only formats and draws the rows in view.
 
-    def add_line(self, text, top, left, color=None):
-        self._panel.addstr(top, left, text, color)
-
-    def refresh(self):
-        return self._panel.refresh()
-
-
-class Panel(object):
-    """ Wrapped newpad object
+    Rows are produced on demand by a render_row(index) callback returning
+    (text, color), so the cost of a frame depends on the height of the view
+    and not on the number of rows.
     """
-    def __init__(self, height, width):
-        self._panel = curses.newpad(height, width)
-        self.selected_row = 0
-        self.ptopy = 0
-        self.ptopx = 0
-        self.stopy = 0
-        self.stopx = 0
-        self.sbottomy = 0
-        self.sbottomx = 0
-        self.max = height
-
-    def set_max(self, value):
-        self.max = value
-
-    def add_line(self, text, top, left, color=None):
-        self._panel.addstr(top, left, text, color)
-
-    def refresh(self, ptopy, ptopx, stopy, stopx, sbottomy, sbottomx):
-        self.ptopx = ptopx
-        self.ptopy = ptopy
-        self.stopy = stopy
-        self.stopx = stopx
-        self.sbottomy = sbottomy
-        self.sbottomx = sbottomx
-
-        return self._panel.refresh(self.ptopy, self.ptopx, self.stopy, self.stopx, self.sbottomy, self.sbottomx)
-
-    def getch(self):
-        return self._panel.getch()
-
-    def scroll_up(self):
-        self.refresh(max(self.ptopy - 1, 0), self.ptopx, self.stopy, self.stopx, self.sbottomy, self.sbottomx)
-
-    def scroll_down(self):
-        self.refresh(min(self.ptopy+1, self.max), self.ptopx, self.stopy, self.stopx, self.sbottomy, self.sbottomx)
\ No newline at end of file
+    def __init__(self, terminal):
+        self._terminal = terminal
+        self._render_row = None
+        self.row_count = 0
+        self.offset = 0
+        self.top = 0
+        self.height = 0
+
+    def set_rows(self, row_count, render_row):
+        self.row_count = row_count
+        self._render_row = render_row
+
+    def resize(self, top, height):
+        self.top = top
+        self.height = max(height, 0)
+
+    def draw(self):
+        self.offset = max(min(self.offset, self.row_count - self.height), 0)
+        for row in range(min(self.height, self.row_count - self.offset)):
+            text, color = self._render_row(self.offset + row)
+            self._terminal.add_line(text, self.top + row, 0, color)
+
+    def scroll_up(self, lines=1):
+        self.offset = max(self.offset - lines, 0)
+
+    def scroll_down(self, lines=1):
+        self.offset = max(min(self.offset + lines, self.row_count - self.height), 0)
+
+    def page_up(self):
+        self.scroll_up(max(self.height - 1, 1))
+
+    def page_down(self):
+        self.scroll_down(max(self.height - 1, 1))
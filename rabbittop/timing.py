@@ -0,0 +1,135 @@
+""" Timing and profiling of rabbittop itself
+"""
+import cProfile
+import collections
+import pstats
+import sys
+import threading
+import time
+
+from rabbittop.history import RingBuffer
+
+# Number of samples per stage the percentiles are computed over
+SAMPLES = 100
+
+# Order of the stages in the summary, by the first word of their name
+STAGE_ORDER = ('fetch', 'decode', 'model', 'refresh', 'draw')
+
+
+class Timings(object):
+    """ Rolling samples of how long each stage of a refresh takes.
+
+    Stages are added by name from any thread: the api client records the
+    round trip (fetch) and json decoding (decode) per endpoint, the model
+    its updates and the ui the drawing of a frame.
+    """
+
+    def __init__(self, size=SAMPLES):
+        self._size = size
+        self._stages = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            samples = self._stages.get(stage)
+            if samples is None:
+                samples = self._stages[stage] = RingBuffer(self._size)
+            samples.append(time.time(), seconds)
+
+    def stages(self):
+        with self._lock:
+            stages = list(self._stages)
+        return sorted(stages, key=lambda stage: (_stage_order(stage), stage))
+
+    def percentile(self, stage, percent):
+        """ Return the duration in seconds percent of the recent samples of stage stay within.
+        """
+        with self._lock:
+            values = sorted(value for _, value in self._stages[stage].samples())
+        return values[min(int(len(values) * percent / 100.0), len(values) - 1)]
+
+    def summary(self):
+        return 'p50/p95 ms -- ' + '  '.join(
+            '%s %.0f/%.0f' % (stage, self.percentile(stage, 50) * 1000, self.percentile(stage, 95) * 1000)
+            for stage in self.stages())
+
+
+def _stage_order(stage):
+    kind = stage.split()[0]
+    return STAGE_ORDER.index(kind) if kind in STAGE_ORDER else len(STAGE_ORDER)
+
+
+class TimedIterator(object):
+    """ Iterate over an iterable and sum the time spent producing its items in `elapsed`.
+
+    The time a consumer spends on the items is what remains of its total.
+    """
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self.elapsed = 0.0
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        started = time.time()
+        try:
+            return next(self._iterator)
+        finally:
+            self.elapsed += time.time() - started
+
+
+class Profiler(object):
+    """ Run cProfile in every thread, starting now, and dump the combined stats on exit.
+
+    cProfile only sees the thread that enabled it, so every thread started
+    afterwards (poller and api calls) enables its own profile. The api
+    calls run in short lived threads, the profiles of the threads that
+    finished are merged into one set of stats whenever a thread starts, so
+    a long session does not keep a profile per thread. The dump is in the
+    pstats format that snakeviz, gprof2dot or flameprof read.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        # The profiles of the threads that may still run, by thread
+        self._profiles = {}
+        # The merged stats of the threads that finished, None until one did
+        self._stats = None
+        self._lock = threading.Lock()
+        threading.setprofile(self._start_thread)
+        self._start()
+
+    def dump(self):
+        threading.setprofile(None)
+        with self._lock:
+            for profile in self._profiles.values():
+                self._merge(profile)
+            self._profiles.clear()
+            if self._stats is not None:
+                self._stats.dump_stats(self._path)
+
+    def _start(self):
+        profile = cProfile.Profile()
+        with self._lock:
+            for thread in [thread for thread in self._profiles if not thread.is_alive()]:
+                self._merge(self._profiles.pop(thread))
+            self._profiles[threading.current_thread()] = profile
+        profile.enable()
+
+    def _merge(self, profile):
+        try:
+            stats = pstats.Stats(profile)
+        except TypeError:
+            # The profile saw no calls
+            return
+        if self._stats is None:
+            self._stats = stats
+        else:
+            self._stats.add(stats)
+
+    def _start_thread(self, frame, event, arg):
+        # Called on the first event of a new thread, cProfile takes over from here
+        sys.setprofile(None)
+        self._start()
@@ -1,4 +1,7 @@
 def human_size(n):
+    # Not a number, e.g. N/A for a node that is down
+    if not isinstance(n, (int, long, float)):
+        return n
     # G
     if n >= (1024*1024*1024):
         return "%.1fG" % (n/(1024*1024*1024))
@@ -8,4 +11,27 @@ def human_size(n):
     # K
     if n >= 1024:
         return "%.1fK" % (n/1024)
-    return "%d" % n
\ No newline at end of file
+    return "%d" % n
+
+_sparkline_levels = '_.-=+*#'
+
+
+def sparkline(values, width):
+    """ Render values as a text sparkline of width characters, newest on the right
+    """
+    values = [float(value) for value in values]
+    if len(values) > width:
+        # Average the values into width buckets
+        step = float(len(values)) / width
+        values = [
+            sum(values[int(index * step):int((index + 1) * step)]) /
+            max(len(values[int(index * step):int((index + 1) * step)]), 1)
+            for index in range(width)
+        ]
+    if not values:
+        return ' ' * width
+    low = min(values)
+    span = max(values) - low
+    top = len(_sparkline_levels) - 1
+    line = ''.join(_sparkline_levels[int((value - low) / span * top) if span else 0] for value in values)
+    return line.rjust(width)
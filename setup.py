@@ -30,11 +30,10 @@ setup(
         # Specify the Python versions you support here. In particular, ensure
         # that you indicate whether you support Python 2, Python 3 or both.
         'Programming Language :: Python :: 2',
-        'Programming Language :: Python :: 2.6',
         'Programming Language :: Python :: 2.7',
     ],
     keywords="monitoring rabbitmq support",
-    packages=find_packages(exclude=['bin', 'docs', 'tests']),
+    packages=find_packages(exclude=['bin', 'docs', 'tests', 'benchmarks']),
     entry_points={
         'console_scripts': [
             'rabbittop=rabbittop.main:main',
@@ -0,0 +1,107 @@
+""" Round trips of snapshots through a Recorder and a Player
+
+    python -m unittest discover tests
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from rabbittop import recording
+
+
+def _queues(messages, names=('a', 'b', 'c')):
+    return [{'vhost': '/', 'name': name, 'messages': messages} for name in names]
+
+
+def _failing(queues, after):
+    """ Yield queues like a JSONStream whose connection drops after some of them.
+    """
+    for index, queue in enumerate(queues):
+        if index == after:
+            raise IOError('connection reset')
+        yield queue
+
+
+class RecordingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cluster.rec')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def replay(self, timestamp):
+        player = recording.Player(self.path)
+        player.seek(timestamp)
+        player.paused = True
+        player.sync()
+        return player
+
+    def assertState(self, player, overview, nodes, queues):
+        self.assertEqual(player.request('overview'), overview)
+        self.assertEqual(player.request('nodes'), nodes)
+        self.assertEqual(player.stream('queues/'), queues)
+
+    def test_round_trip(self):
+        recorder = recording.Recorder(self.path, keyframe_interval=3)
+        recorder.write(1, {'version': 1}, [{'name': 'n'}], _queues(0))
+        recorder.write(2, {'version': 1}, [{'name': 'n'}], _queues(1, ('a', 'b')))
+        recorder.write(3, {'version': 2}, [{'name': 'n'}], _queues(1, ('a', 'b', 'd')))
+        recorder.write(4, {'version': 2}, [{'name': 'n'}], _queues(2))
+        recorder.close()
+
+        self.assertEqual([timestamp for timestamp, _ in recording._load_index(self.path + '.idx')], [1, 4])
+        self.assertState(self.replay(1), {'version': 1}, [{'name': 'n'}], _queues(0))
+        self.assertState(self.replay(2), {'version': 1}, [{'name': 'n'}], _queues(1, ('a', 'b')))
+        self.assertState(self.replay(3.5), {'version': 2}, [{'name': 'n'}], _queues(1, ('a', 'b', 'd')))
+        self.assertState(self.replay(4), {'version': 2}, [{'name': 'n'}], _queues(2))
+
+    def test_seeking_back_and_forth(self):
+        recorder = recording.Recorder(self.path, keyframe_interval=2)
+        for timestamp in range(1, 8):
+            recorder.write(timestamp, {'at': timestamp}, [], _queues(timestamp))
+        recorder.close()
+
+        player = self.replay(6)
+        for timestamp in (2, 7, 3, 5):
+            player.seek(timestamp)
+            player.sync()
+            self.assertState(player, {'at': timestamp}, [], _queues(timestamp))
+
+    def test_queue_stream_failing(self):
+        recorder = recording.Recorder(self.path)
+        recorder.write(1, {'version': 1}, [{'name': 'n'}], _queues(0))
+        # As record() does: the stream fails while it is written, the snapshot is written again without queues
+        with self.assertRaises(IOError):
+            recorder.write(2, {'version': 2}, [{'name': 'n'}], _failing(_queues(1), 2))
+        recorder.write(2, {'version': 2}, [{'name': 'n'}], None)
+        recorder.write(3, {'version': 2}, [{'name': 'n'}], _queues(1))
+        recorder.close()
+
+        self.assertState(self.replay(2), {'version': 2}, [{'name': 'n'}], _queues(0))
+        self.assertState(self.replay(3), {'version': 2}, [{'name': 'n'}], _queues(1))
+
+    def test_without_keyframes(self):
+        recorder = recording.Recorder(self.path)
+        # The queue listing never succeeds, so no keyframe is written
+        for timestamp in range(100, 110):
+            recorder.write(timestamp, {'at': timestamp}, [], None)
+        recorder.write(110, {'at': 110}, [], _queues(0))
+        recorder.write(111, {'at': 111}, [], _queues(1))
+        recorder.close()
+
+        player = recording.Player(self.path)
+        self.assertEqual((player.start, player.end), (100, 111))
+        self.assertState(player, {'at': 100}, [], [])
+        self.assertState(self.replay(105), {'at': 105}, [], [])
+        player = self.replay(111)
+        self.assertState(player, {'at': 111}, [], _queues(1))
+        player.seek(103)
+        player.sync()
+        self.assertState(player, {'at': 103}, [], [])
+
+
+if __name__ == '__main__':
+    unittest.main()